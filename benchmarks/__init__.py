@@ -0,0 +1 @@
+# Benchmarks of the hot paths, run them from the project root, i.e. ``python -m benchmarks.bench_api_parse``
@@ -0,0 +1,62 @@
+"""
+Compare the default path of ``APISpider.parse`` with the fast one (``API_FAST_PATH``) on the saved API page.
+
+    python -m benchmarks.bench_api_parse [--page benchmarks/fixtures/api_page.json] [--rounds 2000]
+"""
+import argparse
+import os
+import time
+
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from houzz.spiders import APISpider
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'api_page.json')
+
+
+def make_spider(fast_path):
+    crawler = get_crawler(APISpider, {'API_FAST_PATH': fast_path, 'CHECKPOINT_ENABLED': False})
+    spider = APISpider.from_crawler(crawler)
+    spider.offsets.clear()  # don't request the next pages
+    return spider
+
+
+def parse(spider, response):
+    return list(spider.parse(response))
+
+
+def measure(fast_path, response, rounds):
+    """
+    :return: items of the page, mean seconds per page
+    """
+    spider = make_spider(fast_path)
+    items = parse(spider, response)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        parse(spider, response)
+    return items, (time.perf_counter() - started) / rounds
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--page', default=FIXTURE, help='Saved response of getProfessionals method')
+    argp.add_argument('--rounds', default=2000, type=int)
+    args = argp.parse_args()
+
+    with open(args.page, 'rb') as f:
+        body = f.read()
+    response = TextResponse(url='https://api.houzz.com/api?method=getProfessionals', body=body, encoding='utf-8',
+                            request=Request('https://api.houzz.com/api?method=getProfessionals', meta={'offset': 0}))
+
+    default_items, default_time = measure(False, response, args.rounds)
+    fast_items, fast_time = measure(True, response, args.rounds)
+    assert [dict(i) for i in default_items] == [dict(i) for i in fast_items], 'fast path gives other items'
+
+    print(f'Profiles on page: {len(default_items)}')
+    print(f'Default path: {default_time * 1000:.3f} ms per page')
+    print(f'Fast path:    {fast_time * 1000:.3f} ms per page ({default_time / fast_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
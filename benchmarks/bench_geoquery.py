@@ -0,0 +1,90 @@
+"""
+Compare geo queries answered by the ``2dsphere`` index with loading all profiles and filtering them in Python.
+Needs running MongoDB, profiles are generated in a separate database which is dropped at the end.
+
+    python -m benchmarks.bench_geoquery [--uri mongodb://localhost:27017/] [--profiles 100000] [--rounds 20]
+"""
+import argparse
+import random
+import time
+
+import pymongo
+
+from houzz.geoquery import GeoQuery, circle, distance_km, point
+from houzz.pipelines import HouzzPipeline
+
+# Japan, profiles are crowded around the big cities as they are on Houzz
+CITIES = ((139.69, 35.69), (135.50, 34.69), (136.91, 35.18), (130.40, 33.59), (141.35, 43.06))
+PREFECTURES = ('東京都', '大阪府', '愛知県', '福岡県', '北海道')
+
+
+def make_profiles(count, seed=1):
+    rnd = random.Random(seed)
+    for i in range(count):
+        city = rnd.randrange(len(CITIES))
+        lon, lat = CITIES[city]
+        lon, lat = lon + rnd.gauss(0, 0.3), lat + rnd.gauss(0, 0.3)
+        yield {'user_name': f'pro-{i}', 'address': {'prefecture': PREFECTURES[city]}, 'coordinates': [lon, lat],
+               'location': point(lon, lat), 'pro_rating': round(rnd.uniform(1, 5), 1)}
+
+
+def scan_radius(collection, lon, lat, km):
+    """
+    The way without the index: load all coordinates and filter them by the distance
+    """
+    found = []
+    for doc in collection.find({}, {'_id': False, 'user_name': True, 'coordinates': True}):
+        if distance_km(lon, lat, *doc['coordinates']) <= km:
+            found.append(doc['user_name'])
+    return found
+
+
+def measure(func, rounds):
+    result = func()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return result, (time.perf_counter() - started) / rounds
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--uri', default='mongodb://localhost:27017/')
+    argp.add_argument('--profiles', default=100000, type=int)
+    argp.add_argument('--rounds', default=20, type=int)
+    argp.add_argument('--km', default=5, type=float, help='Radius of the queries')
+    args = argp.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    db = client['houzz_bench_geoquery']
+    collection = db[HouzzPipeline.profile_collection_name]
+    collection.drop()
+    try:
+        collection.insert_many(make_profiles(args.profiles), ordered=False)
+        collection.create_index([('location', pymongo.GEOSPHERE)])
+        query = GeoQuery(collection)
+        lon, lat = CITIES[0]
+
+        indexed, indexed_time = measure(lambda: [d['user_name'] for d in query.radius(lon, lat, args.km)],
+                                        args.rounds)
+        scanned, scan_time = measure(lambda: scan_radius(collection, lon, lat, args.km), max(args.rounds // 10, 1))
+        assert set(indexed) == set(scanned), 'index gives other profiles than the scan'
+        print(f'Radius {args.km} km, {len(indexed)} of {args.profiles} profiles')
+        print(f'  scan in Python: {scan_time * 1000:9.2f} ms')
+        print(f'  2dsphere index: {indexed_time * 1000:9.2f} ms ({scan_time / indexed_time:.1f}x)')
+
+        found, spent = measure(lambda: list(query.bbox(lon - 0.1, lat - 0.1, lon + 0.1, lat + 0.1)), args.rounds)
+        print(f'Bounding box 0.2 x 0.2 degrees, {len(found)} profiles: {spent * 1000:.2f} ms')
+
+        found, spent = measure(lambda: list(query.regions(grid=0.5, within=circle(lon, lat, 50))), args.rounds)
+        print(f'Cells of 0.5 degrees within 50 km, {len(found)} cells: {spent * 1000:.2f} ms')
+
+        found, spent = measure(lambda: list(query.regions()), max(args.rounds // 10, 1))
+        print(f'Prefectures of all profiles, {len(found)} regions: {spent * 1000:.2f} ms')
+    finally:
+        client.drop_database(db)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
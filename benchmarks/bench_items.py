@@ -0,0 +1,91 @@
+"""
+Measure time and memory per profile on the way from the API page to the upsert of ``HouzzPipeline``,
+for ``Profile`` items of the item loaders and for plain dicts of the fast path (``API_FAST_PATH``).
+
+    python -m benchmarks.bench_items [--profiles 20000]
+
+Upserts of all profiles are kept alive, as the pipeline buffer keeps them, so the retained memory per profile
+is measured by ``tracemalloc``. Time is measured by a separate pass without tracing.
+"""
+import argparse
+import json
+import math
+import os
+import time
+import tracemalloc
+
+from pymongo.operations import UpdateOne
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from houzz.items import as_dict
+from houzz.spiders import APISpider
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'api_page.json')
+URL = 'https://api.houzz.com/api?method=getProfessionals'
+
+
+def make_responses(profiles):
+    """
+    Pages of the recorded API response with unique user names, ``profiles`` professionals in total
+    """
+    with open(FIXTURE, encoding='utf-8') as f:
+        page = json.load(f)
+    per_page = len(page['Professionals'])
+    responses = []
+    for number in range(math.ceil(profiles / per_page)):
+        for i, prof in enumerate(page['Professionals']):
+            prof['UserName'] = f'pro-{number}-{i}'
+        body = json.dumps(page, ensure_ascii=False).encode('utf-8')
+        responses.append(TextResponse(url=URL, body=body, encoding='utf-8',
+                                      request=Request(URL, meta={'offset': number * per_page})))
+    return responses
+
+
+def make_spider(fast_path):
+    crawler = get_crawler(APISpider, {'API_FAST_PATH': fast_path, 'CHECKPOINT_ENABLED': False})
+    spider = APISpider.from_crawler(crawler)
+    spider.offsets.clear()  # don't request the next pages
+    return spider
+
+
+def upserts(spider, responses):
+    """
+    Parse the pages and build the upserts as ``HouzzPipeline.process_item`` does
+    """
+    return [UpdateOne({'user_name': item['user_name']}, {'$set': as_dict(item)}, upsert=True)
+            for response in responses for item in spider.parse(response)]
+
+
+def measure(fast_path, responses):
+    """
+    :return: amount of profiles, seconds per profile, retained and peak bytes per profile
+    """
+    spider = make_spider(fast_path)
+    started = time.perf_counter()
+    count = len(upserts(spider, responses))
+    spent = time.perf_counter() - started
+
+    spider = make_spider(fast_path)
+    tracemalloc.start()
+    operations = upserts(spider, responses)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del operations
+    return count, spent / count, current / count, peak / count
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--profiles', default=20000, type=int)
+    args = argp.parse_args()
+
+    responses = make_responses(args.profiles)
+    for name, fast_path in (('Profile items', False), ('Plain dicts', True)):
+        count, spent, retained, peak = measure(fast_path, responses)
+        print(f'{name:14} {count} profiles: {spent * 1e6:8.1f} us, {retained:7.0f} bytes retained, '
+              f'{peak:7.0f} bytes peak per profile')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare formatting every phone by ``format_phone`` with the cached ``PhoneNormalizer``.
+Phones are generated in the format of the recorded API page and repeated as shared office numbers are.
+
+    python -m benchmarks.bench_phones [--phones 20000] [--unique 500]
+"""
+import argparse
+import time
+
+from phonenumbers import NumberParseException
+
+from houzz.items import format_phone
+from houzz.phones import PhoneNormalizer
+
+
+def make_phones(count, unique):
+    return [(f'03-{5400 + i % unique // 100:04d}-{1000 + i % unique:04d}', 'jp') for i in range(count)]
+
+
+def format_each(phones):
+    result = []
+    for raw, country in phones:
+        try:
+            result.append(format_phone(raw, country))
+        except NumberParseException:
+            result.append(raw)
+    return result
+
+
+def measure(func, phones):
+    started = time.perf_counter()
+    result = func(phones)
+    return result, time.perf_counter() - started
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--phones', default=20000, type=int)
+    argp.add_argument('--unique', default=500, type=int, help='Amount of different phone numbers')
+    args = argp.parse_args()
+    phones = make_phones(args.phones, args.unique)
+
+    plain, plain_time = measure(format_each, phones)
+    normalizer = PhoneNormalizer()
+    cached, cached_time = measure(lambda p: [normalizer.normalize(raw, c) for raw, c in p], phones)
+    assert plain == cached, 'cached normalization gives other phones'
+
+    print(f'Phones: {args.phones}, unique: {args.unique}')
+    print(f'format_phone: {plain_time * 1e6 / args.phones:.2f} us per phone')
+    print(f'cached:       {cached_time * 1e6 / args.phones:.2f} us per phone ({plain_time / cached_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
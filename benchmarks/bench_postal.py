@@ -0,0 +1,74 @@
+"""
+Measure the offline postal geo coder: loading of the table, lookups one by one and by pages with ``lookup_many``.
+The table is generated in the format of GeoNames dump with as many postals as Japan has.
+
+    python -m benchmarks.bench_postal [--postals 120000] [--queries 20000] [--page 75]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from houzz.geo import PostalCodeGeocoder
+
+
+def write_table(path, count, seed=1):
+    rnd = random.Random(seed)
+    postals = rnd.sample(range(10000000), count)
+    with open(path, 'w', encoding='utf-8') as f:
+        for postal in postals:
+            postal = f'{postal:07d}'
+            lat, lon = rnd.uniform(24, 45), rnd.uniform(123, 146)
+            f.write(f'JP\t{postal[:3]}-{postal[3:]}\t渋谷\t東京都\t40\t渋谷区\t13113\t\t\t{lat:.4f}\t{lon:.4f}\t6\n')
+    return postals
+
+
+def make_queries(postals, count, miss_ratio=0.05, seed=2):
+    """
+    Location strings as in the API pages, some of them are missing from the table
+    """
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        postal = f'{rnd.choice(postals):07d}' if rnd.random() > miss_ratio else '0000000'
+        queries.append(f'渋谷区, 東京都 {postal[:3]}-{postal[3:]}')
+    return queries
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--postals', default=120000, type=int, help='Size of the table')
+    argp.add_argument('--queries', default=20000, type=int)
+    argp.add_argument('--page', default=75, type=int, help='Queries of one lookup_many call')
+    args = argp.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'JP.txt')
+        postals = write_table(path, args.postals)
+        started = time.perf_counter()
+        geocoder = PostalCodeGeocoder.from_geonames(path)
+        load_time = time.perf_counter() - started
+    size = sum(a.itemsize * len(a) for a in (geocoder.keys, geocoder.lons, geocoder.lats))
+    print(f'Table of {len(geocoder)} postals: loaded in {load_time * 1000:.0f} ms, {size / 2 ** 20:.1f} MB of arrays')
+
+    queries = make_queries(postals, args.queries)
+    started = time.perf_counter()
+    single = [geocoder.lookup(query) for query in queries]
+    single_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    paged = []
+    for i in range(0, len(queries), args.page):
+        paged.extend(geocoder.lookup_many(queries[i:i + args.page]))
+    paged_time = time.perf_counter() - started
+    assert single == paged, 'lookup_many gives other coordinates'
+
+    hits = sum(result is not None for result in single)
+    print(f'Queries: {len(queries)}, found: {hits}')
+    print(f'lookup:      {single_time * 1e6 / len(queries):.2f} us per query')
+    print(f'lookup_many: {paged_time * 1e6 / len(queries):.2f} us per query, pages of {args.page}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare extraction of profile pages by item loaders with the precompiled one (``PROFILE_FAST_PATH``)
+on the recorded profile pages.
+
+    python -m benchmarks.bench_profile_parse [--pages 200] [--rounds 20]
+"""
+import argparse
+import time
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from benchmarks.mockserver import Site
+from houzz.spiders import ProfilesSpider
+
+
+def make_spider(fast_path):
+    crawler = get_crawler(ProfilesSpider, {'PROFILE_FAST_PATH': fast_path, 'PROJECTS_COUNT_MODE': 'inline'})
+    return ProfilesSpider.from_crawler(crawler)
+
+
+def make_responses(pages):
+    site = Site(total=pages)
+    responses = []
+    for i in range(pages):
+        url = f'https://www.houzz.jp/pro/{site.name(i)}/{site.name(i)}-design'
+        responses.append(HtmlResponse(url=url, body=site.profile_page(site.name(i)).encode('utf-8'),
+                                      encoding='utf-8', request=Request(url)))
+    return responses
+
+
+def measure(fast_path, pages, rounds):
+    """
+    :return: items of the pages, mean seconds per page
+    """
+    spider = make_spider(fast_path)
+    items = [item for response in make_responses(pages) for item in spider.parse_profile(response)]
+    spent = 0
+    for _ in range(rounds):
+        responses = make_responses(pages)  # responses cache parsed trees, so new ones are made every round
+        started = time.perf_counter()
+        for response in responses:
+            list(spider.parse_profile(response))
+        spent += time.perf_counter() - started
+    return items, spent / rounds / pages
+
+
+def main():
+    argp = argparse.ArgumentParser()
+    argp.add_argument('--pages', default=200, type=int)
+    argp.add_argument('--rounds', default=20, type=int)
+    args = argp.parse_args()
+
+    default_items, default_time = measure(False, args.pages, args.rounds)
+    fast_items, fast_time = measure(True, args.pages, args.rounds)
+    assert [dict(i) for i in default_items] == [dict(i) for i in fast_items], 'fast path gives other items'
+
+    print(f'Profile pages: {args.pages}')
+    print(f'Item loaders: {default_time * 1000:.3f} ms per page')
+    print(f'Precompiled:  {fast_time * 1000:.3f} ms per page ({default_time / fast_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
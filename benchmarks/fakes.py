@@ -0,0 +1,128 @@
+"""
+Stand-ins of the remote services used by the benchmarks: geo coder with configurable latency,
+in-memory MongoDB and the spider middleware timing callbacks
+"""
+import time
+
+from scrapy import signals
+
+from houzz.pipelines import GeoPipeline, HouzzPipeline
+
+
+class FakeGeoLocator:
+    """
+    Answer every query with the same coordinates after ``latency`` seconds
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def geolocate(self, query: str, default_code: str = 'JP'):
+        time.sleep(self.latency)
+        return (139.7, 35.6), 'jp'
+
+
+class MemoryCollection:
+    """
+    The part of ``pymongo.collection.Collection`` used by ``HouzzPipeline``
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            key = repr(sorted(operation._filter.items()))
+            self.documents.setdefault(key, {}).update(operation._doc.get('$set', {}))
+
+    def update_one(self, filter, update, upsert=False):
+        document = self.documents.setdefault(repr(sorted(filter.items())), dict(filter))
+        for operator, fields in update.items():
+            document.update(fields)
+
+    def find_one(self, filter, projection=None):
+        return self.documents.get(repr(sorted(filter.items())))
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+
+class MemoryDatabase(dict):
+    def __missing__(self, name):
+        self[name] = collection = MemoryCollection()
+        return collection
+
+
+class MemoryClient(dict):
+    """
+    Replacement of ``pymongo.MongoClient`` keeping everything in memory
+    """
+
+    def __init__(self, uri=None):
+        super().__init__()
+
+    def __missing__(self, name):
+        self[name] = database = MemoryDatabase()
+        return database
+
+    def close(self):
+        pass
+
+
+class BenchGeoPipeline(GeoPipeline):
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = super().from_crawler(crawler)
+        pipeline.locator = FakeGeoLocator(crawler.settings.getfloat('BENCH_GEO_LATENCY', 0.05))
+        return pipeline
+
+
+class BenchMongoPipeline(HouzzPipeline):
+    client_class = MemoryClient
+
+
+def percentile(values, q):
+    """
+    :param values: sorted values
+    :param q: percentile from 0 to 1
+    """
+    if not values:
+        return 0
+    return values[int(round(q * (len(values) - 1)))]
+
+
+class CallbackTimer:
+    """
+    Spider middleware measuring the time spent by the spider callback on each response.
+    Put it close to the spider, so only the callback is measured
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.durations = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        timer = cls(crawler.stats)
+        crawler.signals.connect(timer.spider_closed, signal=signals.spider_closed)
+        return timer
+
+    def process_spider_output(self, response, result, spider):
+        spent = 0
+        iterator = iter(result)
+        while True:
+            started = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                spent += time.perf_counter() - started
+            yield value
+        self.durations.append(spent)
+
+    def spider_closed(self, spider):
+        durations = sorted(self.durations)
+        self.stats.set_value('bench/callbacks', len(durations))
+        self.stats.set_value('bench/callback_p50_ms', percentile(durations, 0.5) * 1000)
+        self.stats.set_value('bench/callback_p99_ms', percentile(durations, 0.99) * 1000)
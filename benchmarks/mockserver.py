@@ -0,0 +1,152 @@
+"""
+Local HTTP stand-in of houzz.jp and api.houzz.com which replays the recorded pages from ``fixtures``.
+
+Listing pages are ``/professionals`` and ``/professionals/p/<offset>``, profiles are ``/pro/<name>/...``,
+API pages are ``/api?start=<offset>&numberOfItems=<count>``. Profile names are generated from the offset,
+so any amount of profiles can be served.
+"""
+import copy
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+PREFECTURES = (('東京都', '渋谷区', '150-0002'), ('大阪府', '大阪市北区', '530-0001'),
+               ('神奈川県', '横浜市中区', '231-0023'), ('愛知県', '名古屋市中区', '460-0008'),
+               ('福岡県', '福岡市中央区', '810-0001'))
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+class Site:
+    """
+    Pages of the fake site with ``total`` professionals, ``per_page`` of them on one listing page
+    """
+
+    def __init__(self, total=1000, per_page=15):
+        self.total = total
+        self.per_page = per_page
+        self.listing = read_fixture('listing.html')
+        self.card = read_fixture('listing_card.html')
+        self.profile = read_fixture('profile.html')
+        self.projects = read_fixture('projects.html')
+        self.api_page = json.loads(read_fixture('api_page.json'))
+
+    @staticmethod
+    def name(index):
+        return f'pro-studio-{index:06d}'
+
+    def fields(self, index):
+        prefecture, city, postal = PREFECTURES[index % len(PREFECTURES)]
+        return {
+            'name': self.name(index),
+            'company': f'Studio {index:06d} Design Office',
+            'contact': f'Taro Yamada {index}',
+            'service': 'Interior Designers & Decorators',
+            'phone': f'03-{5400 + index % 600:04d}-{1000 + index % 9000:04d}',
+            'street': f'{index % 9 + 1}-{index % 20 + 1}-{index % 7 + 1}',
+            'city': city,
+            'prefecture': prefecture,
+            'postal': postal,
+            'license': 10000 + index,
+            'rating': f'{3 + index % 20 / 10:.1f}',
+            'reviews': index % 40,
+            'projects': index % 25,
+        }
+
+    def listing_page(self, offset):
+        cards = '\n'.join(self.card.format(**self.fields(i))
+                          for i in range(offset, min(offset + self.per_page, self.total)))
+        navigation = []
+        if offset > 0:
+            previous = f'/professionals/p/{offset - self.per_page}' if offset > self.per_page else '/professionals'
+            navigation.append(f'<a class="navigation-button prev" href="{previous}">前へ</a>')
+        if offset + self.per_page < self.total:
+            navigation.append(f'<a class="navigation-button next" href="/professionals/p/{offset + self.per_page}">次へ</a>')
+        return self.listing.format(total=self.total, cards=cards, navigation='\n'.join(navigation))
+
+    def index_of(self, name):
+        return int(name.rsplit('-', 1)[1])
+
+    def profile_page(self, name):
+        return self.profile.format(**self.fields(self.index_of(name)))
+
+    def projects_page(self, name):
+        return self.projects.format(**self.fields(self.index_of(name)))
+
+    def api(self, start, count):
+        page = copy.deepcopy(self.api_page)
+        recorded = page['Professionals']
+        professionals = []
+        for i in range(start, min(start + count, self.total)):
+            prof = copy.deepcopy(recorded[i % len(recorded)])
+            prof['UserName'] = self.name(i)
+            professionals.append(prof)
+        page['Professionals'] = professionals
+        page['TotalProfessionalCount'] = str(self.total)
+        return json.dumps(page, ensure_ascii=False)
+
+
+class Handler(BaseHTTPRequestHandler):
+    site: Site = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        content_type = 'text/html; charset=utf-8'
+        if parts == ['api']:
+            query = parse_qs(url.query)
+            body = self.site.api(int(query['start'][0]), int(query['numberOfItems'][0]))
+            content_type = 'application/json; charset=utf-8'
+        elif parts[:1] == ['professionals']:
+            body = self.site.listing_page(int(parts[2]) if len(parts) > 2 else 0)
+        elif parts[:1] == ['pro'] and len(parts) >= 2:
+            if parts[-1] == 'projects':
+                body = self.site.projects_page(parts[1])
+            else:
+                body = self.site.profile_page(parts[1])
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer:
+    """
+    Run the fake site in a background thread
+
+        with MockServer(total=500) as server:
+            server.url('/professionals')
+    """
+
+    def __init__(self, total=1000, per_page=15, host='127.0.0.1', port=0):
+        handler = type('SiteHandler', (Handler,), {'site': Site(total, per_page)})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path=''):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,155 @@
+"""
+Run ``ProfilesSpider`` and ``APISpider`` end to end against the local stand-ins of Houzz, geo coder and MongoDB.
+
+    python -m benchmarks.run --spider all --profiles 2000 --geo-latency 0.05 --output results.json
+    python -m benchmarks.run --compare old.json new.json
+    python -m benchmarks.run --httpcache .benchcache --port 8899  # twice, the second run is warm
+
+Reports items per second, p50/p99 callback latency, peak RSS and requests per item. Results are saved as JSON,
+``--compare`` prints the difference between two saved runs and exits with 1 if some metric became worse
+more than ``--threshold`` percents.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import resource
+import sys
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+from benchmarks.mockserver import MockServer
+from houzz.spiders import APISpider, ProfilesSpider
+
+# metric -> True if the bigger value is better
+METRICS = {
+    'items_per_sec': True,
+    'callback_p50_ms': False,
+    'callback_p99_ms': False,
+    'peak_rss_mb': False,
+    'requests_per_item': False,
+}
+
+
+def run_spider(name, profiles, geo_latency, httpcache=None, port=0):
+    """
+    Crawl the fake site by the spider in the current process
+
+    :param httpcache: directory of the HTTP cache, None to disable it
+    :param port: port of the fake site, responses are cached by URL, so it must be the same for warm runs
+    :return: measured metrics
+    """
+    with MockServer(total=profiles, port=port) as server:
+        settings = get_project_settings()
+        settings.setdict({
+            'LOG_LEVEL': 'WARNING',
+            'ROBOTSTXT_OBEY': False,
+            'TELNETCONSOLE_ENABLED': False,
+            'MAX_COUNT': profiles,
+            'START_FROM': 0,
+            'CHECKPOINT_ENABLED': False,
+            'INCREMENTAL': False,
+            'GEO_CACHE_PATH': None,
+            'BENCH_GEO_LATENCY': geo_latency,
+            'ITEM_PIPELINES': {
+                'benchmarks.fakes.BenchGeoPipeline': 200,
+                'benchmarks.fakes.BenchMongoPipeline': 300,
+            },
+            'SPIDER_MIDDLEWARES': {
+                'benchmarks.fakes.CallbackTimer': 950,
+            },
+        }, priority='cmdline')
+        if httpcache is not None:
+            settings.setdict({'HTTPCACHE_ENABLED': True, 'HTTPCACHE_DIR': httpcache}, priority='cmdline')
+
+        process = CrawlerProcess(settings)
+        if name == 'profiles':
+            crawler = process.create_crawler(ProfilesSpider)
+            process.crawl(crawler, start_urls=[server.url('/professionals')])
+        else:
+            crawler = process.create_crawler(APISpider)
+            process.crawl(crawler, url=server.url('/api?'))
+        process.start()
+
+    stats = crawler.stats.get_stats()
+    items = stats.get('item_scraped_count', 0)
+    spent = (stats['finish_time'] - stats['start_time']).total_seconds()
+    return {
+        'items': items,
+        'seconds': spent,
+        'items_per_sec': items / spent if spent else 0,
+        'callback_p50_ms': stats.get('bench/callback_p50_ms', 0),
+        'callback_p99_ms': stats.get('bench/callback_p99_ms', 0),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'requests_per_item': stats.get('downloader/request_count', 0) / items if items else 0,
+    }
+
+
+def benchmark(spiders, profiles, geo_latency, httpcache=None, port=0):
+    """
+    Run every spider in a fresh process, because Twisted reactor can't be restarted
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in spiders:
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(run_spider, (name, profiles, geo_latency, httpcache, port))
+            # let the worker exit by itself, terminating it sometimes hangs
+            pool.close()
+            pool.join()
+        print(f'{name}: ' + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                      for k, v in results[name].items()))
+    return {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'profiles': profiles,
+        'geo_latency': geo_latency,
+        'httpcache': httpcache is not None,
+        'runs': results,
+    }
+
+
+def compare(old, new, threshold):
+    """
+    Print the difference of two saved results
+
+    :return: True if some metric became worse more than ``threshold`` percents
+    """
+    regressed = False
+    for name, run in new['runs'].items():
+        if name not in old['runs']:
+            continue
+        for metric, bigger_better in METRICS.items():
+            before, after = old['runs'][name][metric], run[metric]
+            change = (after - before) / before * 100 if before else 0
+            worse = change < -threshold if bigger_better else change > threshold
+            regressed = regressed or worse
+            print(f'{name:10} {metric:18} {before:12.3f} -> {after:12.3f} {change:+7.1f}%{"  WORSE" if worse else ""}')
+    return regressed
+
+
+def main():
+    argp = argparse.ArgumentParser(prog='benchmarks.run')
+    argp.add_argument('--spider', choices=('profiles', 'api', 'all'), default='all')
+    argp.add_argument('--profiles', default=1000, type=int, help='Amount of profiles on the fake site')
+    argp.add_argument('--geo-latency', default=0.05, type=float, help='Seconds the fake geo coder answers')
+    argp.add_argument('--httpcache', default=None, help='Directory of the HTTP cache, disabled by default')
+    argp.add_argument('--port', default=0, type=int, help='Port of the fake site, random by default')
+    argp.add_argument('--output', default=None, help='Where to save results as JSON')
+    argp.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two saved results')
+    argp.add_argument('--threshold', default=5, type=float, help='Percents of change counted as regression')
+    args = argp.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            sys.exit(1 if compare(json.load(f_old), json.load(f_new), args.threshold) else 0)
+
+    spiders = ('profiles', 'api') if args.spider == 'all' else (args.spider,)
+    result = benchmark(spiders, args.profiles, args.geo_latency, args.httpcache, args.port)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,321 @@
+"""
+Run ``APISpider`` in parallel processes.
+
+The range of profiles is split into work units of a few pages. Worker processes live through the whole crawl
+and take units one by one from the orchestrator. The unit with failed pages is put back to the queue and retried
+by some worker. The worker which dies without the result, i.e. killed by the OOM killer, fails its units
+and is replaced by a new one.
+Every worker adds its stats to the same ``logs`` document selected by the process hash.
+
+Run it with ``python -m houzz -p 5 -m 5000``
+
+With ``--distributed`` the units are kept in ``work_units`` collection of MongoDB, so the same command with
+the same process hash can be run on several hosts. Workers lease units from it until all of them are done,
+units of dead workers are leased again when their leases expire.
+"""
+import argparse
+import datetime
+import math
 import multiprocessing
+import queue
+import random
+import time
+from collections import Counter, deque
 
+import pymongo
 from scrapy.crawler import CrawlerProcess
-import houzz.settings as settings
+from scrapy.utils.project import get_project_settings
+
+from houzz.pipelines import HouzzPipeline
 from houzz.spiders import APISpider
+from houzz.workqueue import LocalWorkQueue, WorkQueue
+
+
+def get_arguments():
+    """
+    Parse command line arguments
+    """
+    settings = get_project_settings()
+    argp = argparse.ArgumentParser(prog='houzz')
+    argp.add_argument('-p', '--pool', help='Process pool length', dest='pool', default=1, type=int)
+    argp.add_argument('-m', '--max', help='Max amount of profiles to process', dest='max_',
+                      default=settings.getint('MAX_COUNT'), type=int)
+    argp.add_argument('-s', '--start', help='From which profile to start', dest='start',
+                      default=settings.getint('START_FROM'), type=int)
+    argp.add_argument('-u', '--unit', help='Amount of pages in one work unit', dest='unit', default=5, type=int)
+    argp.add_argument('-r', '--retries', help='How many times to retry the failed unit', dest='retries',
+                      default=2, type=int)
+    argp.add_argument('-H', '--hash', help='Hash of the crawl to resume or join', dest='process_hash', default=None)
+    argp.add_argument('-d', '--distributed', help='Take work units from the queue shared by several hosts',
+                      dest='distributed', action='store_true')
+
+    return argp.parse_args()
+
+
+def crawl_leased(process_hash, work=None):
+    """
+    Crawl units leased from the work queue in the current process until there are no more
+
+    :param process_hash: hash of the crawl
+    :param work: ``LocalWorkQueue`` fed by the orchestrator, the shared queue of MongoDB is used by default
+    :return: stats of the crawler
+    """
+    settings = get_project_settings()
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(APISpider)
+    process.crawl(crawler, process_hash=process_hash, distributed=True, work=work)
+    process.start()
+    return crawler.stats.get_stats()
+
+
+def work(results, tag, target, args):
+    """
+    Body of the worker process, puts ``('finished', tag, (stats, error))`` into the results queue
+    """
+    try:
+        results.put(('finished', tag, (target(*args), None)))
+    except Exception as e:
+        results.put(('finished', tag, (None, repr(e))))
 
 
-def crawl(params, queue):
-    process = CrawlerProcess(params)
-    process.crawl(APISpider, queue=queue)
+def start_worker(context, results, tag, target, *args) -> multiprocessing.Process:
+    """
+    Start the new process for the crawl, Twisted reactor can't be restarted in the same one
+    """
+    process = context.Process(target=work, args=(results, tag, target, args), daemon=True)
     process.start()
-    process.stop()
-
-
-params = {}
-for k in dir(settings):
-    params[k] = getattr(settings, k)
-
-total_max = params['MAX_COUNT']
-step = total_max // 5
-start_from = params['START_FROM']
-
-q = multiprocessing.Manager().Queue()
-with multiprocessing.Pool(5) as pool:
-    args = []
-    for i in range(start_from, total_max, step):
-        d = params.copy()
-        d['START_FROM'] = i
-        d['MAX_COUNT'] = i + step
-        args.append((d, q))
-    pool.starmap(crawl, args)
-
-begin_extracted = False
-processed = 0
-while not q.empty():
-    val = q.get()
-    if not begin_extracted:
-        begin_time = val['start_datetime']
-        begin_extracted = True
-    end_time = val['finish_datetime']
-    processed += val['profiles_added']
-
-print(f"Time per profile: {(end_time - begin_time).total_seconds() / processed}")
+    return process
+
+
+def wait_message(results, running):
+    """
+    Wait for the next message of any running worker. The worker killed by a signal or the OOM killer
+    never puts its result, so it's reported as failed by its exit code instead of waiting forever
+
+    :param results: queue the workers put their messages into
+    :param running: processes of the running workers by their tags
+    :return: kind, tag, payload
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            pass
+        for tag, process in running.items():
+            if process.exitcode is not None:
+                try:
+                    return results.get(timeout=1)  # the result may be put right before the exit
+                except queue.Empty:
+                    return 'finished', tag, (None, f'worker exited with code {process.exitcode}')
+
+
+def worker_error(stats, error):
+    """
+    :return: error of the finished worker or None if its crawl has finished
+    """
+    if error is None and not stats.get('finish_reason'):
+        return 'crawl didn\'t finish'
+    return error
+
+
+def split_units(start_from, end, items_on_page, unit_pages):
+    """
+    Split the range of profiles into work units of ``unit_pages`` pages
+    """
+    step = items_on_page * unit_pages
+    return deque((offset, min(unit_pages, math.ceil((end - offset) / items_on_page)))
+                 for offset in range(start_from, end, step))
+
+
+def run(pool, max_, start_from, unit_pages=5, retries=2, process_hash=None):
+    """
+    Crawl profiles by the pool of processes. Workers live through the whole crawl and take units one by one,
+    the unit with failed pages or of the worker which died is retried
+
+    :param pool: amount of worker processes
+    :param max_: max amount of profiles to process
+    :param start_from: from which profile to start
+    :param unit_pages: amount of pages in one work unit
+    :param retries: how many times to retry the failed unit
+    :param process_hash: hash of the crawl to resume, already crawled pages are skipped
+    :return: process hash of the crawl
+    """
+    settings = get_project_settings()
+    if process_hash is None:
+        process_hash = hex(random.getrandbits(128))[2:]
+    print(f'Process hash: {process_hash}')
+    end = start_from + max_
+    items_on_page = settings.getint('ITEMS_ON_PAGE')
+    units = {offset: {'_id': offset, 'start': offset, 'end': min(offset + pages * items_on_page, end)}
+             for offset, pages in split_units(start_from, end, items_on_page, unit_pages)}
+    pending = set(units)  # units which aren't done or given up
+    attempts = Counter()
+    failed = []
+
+    started = datetime.datetime.utcnow()
+    context = multiprocessing.get_context('spawn')
+    todo = context.Queue()
+    results = context.Queue()
+    for unit in units.values():
+        todo.put(unit)
+
+    def retry(unit_id, reason):
+        attempts[unit_id] += 1
+        unit = units[unit_id]
+        if attempts[unit_id] <= retries:
+            print(f'Unit {unit["start"]}-{unit["end"]} failed ({reason}), retrying')
+            todo.put(unit)
+            return
+        print(f'Unit {unit["start"]}-{unit["end"]} failed {attempts[unit_id]} times, giving up')
+        failed.append((unit['start'], unit['end']))
+        finish(unit_id)
+
+    def finish(unit_id):
+        pending.discard(unit_id)
+        if not pending:
+            for _ in running:
+                todo.put(None)  # let the waiting workers close
+
+    running = {}
+    leased = {}  # tag of the worker -> units it's crawling
+    worked = set()  # tags of the workers which leased any unit
+    for tag in range(min(pool, len(units))):
+        running[tag] = start_worker(context, results, tag, crawl_leased, process_hash,
+                                    LocalWorkQueue(todo, results, tag))
+        leased[tag] = set()
+    next_tag = len(running)
+
+    while running:
+        kind, tag, payload = wait_message(results, running)
+        if tag not in running:
+            continue  # the result of the worker which is already reported dead
+        if kind == 'leased':
+            leased[tag].add(payload)
+            worked.add(tag)
+        elif kind == 'done':
+            leased[tag].discard(payload)
+            print(f'Unit {units[payload]["start"]}-{units[payload]["end"]} is done')
+            finish(payload)
+        elif kind == 'failed':
+            leased[tag].discard(payload)
+            retry(payload, 'some pages failed')
+        else:
+            running.pop(tag).join()
+            stats, error = payload
+            error = worker_error(stats or {}, error)
+            if error is None:
+                print(f'Worker finished: {stats.get("work/done_units", 0)} units done, '
+                      f'{stats.get("profiles_added", 0)} profiles added')
+            else:
+                print(f'Worker failed: {error}')
+            for unit_id in leased.pop(tag):
+                retry(unit_id, 'worker died')
+            # the worker which failed before leasing anything, i.e. by bad settings, would fail again
+            if pending and tag in worked:
+                running[next_tag] = start_worker(context, results, next_tag, crawl_leased, process_hash,
+                                                 LocalWorkQueue(todo, results, next_tag))
+                leased[next_tag] = set()
+                next_tag += 1
+
+    for unit_id in sorted(pending):
+        print(f'Unit {units[unit_id]["start"]}-{units[unit_id]["end"]} isn\'t crawled, no workers left')
+        failed.append((units[unit_id]['start'], units[unit_id]['end']))
+    save_log(settings, process_hash, started, failed)
+    return process_hash
+
+
+def run_distributed(pool, max_, start_from, unit_pages=5, process_hash=None, max_idle_rounds=3):
+    """
+    Publish work units into the shared queue and crawl them by the pool of processes. Other hosts join
+    the crawl by the same command with the printed process hash
+
+    :param pool: amount of worker processes on this host
+    :param max_: max amount of profiles to process
+    :param start_from: from which profile to start
+    :param unit_pages: amount of pages in one work unit
+    :param process_hash: hash of the crawl to join or resume
+    :param max_idle_rounds: how many rounds of workers may lease nothing while there are pending units
+    :return: process hash of the crawl
+    """
+    settings = get_project_settings()
+    if process_hash is None:
+        process_hash = hex(random.getrandbits(128))[2:]
+    print(f'Process hash: {process_hash}')
+    end = start_from + max_
+    items_on_page = settings.getint('ITEMS_ON_PAGE')
+    work = WorkQueue.from_settings(settings, process_hash)
+    work.ensure_indexes()
+    work.publish((offset, min(offset + pages * items_on_page, end))
+                 for offset, pages in split_units(start_from, end, items_on_page, unit_pages))
+
+    started = datetime.datetime.utcnow()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    idle_rounds = 0
+    given_up = []
+    while True:
+        running = {i: start_worker(context, results, i, crawl_leased, process_hash) for i in range(pool)}
+        leased = 0
+        while running:
+            _, i, (stats, error) = wait_message(results, running)
+            running.pop(i).join()
+            error = worker_error(stats or {}, error)
+            if stats:
+                leased += stats.get('work/leased_units', 0)
+            if error is None:
+                print(f'Worker finished: {stats.get("work/done_units", 0)} units done, '
+                      f'{stats.get("profiles_added", 0)} profiles added')
+            else:
+                # units leased by the dead worker are leased again when their leases expire
+                print(f'Worker failed: {error}')
+
+        counts = work.counts()
+        print(f'Units: {counts}')
+        if not counts['pending'] and not counts['leased']:
+            break
+        if not counts['pending']:
+            # the rest is crawled by other hosts, wait until it's done or their leases expire
+            time.sleep(min(work.lease_time / 3, 30))
+        elif not leased:
+            # workers fail before leasing, i.e. by bad settings or unreachable MongoDB
+            idle_rounds += 1
+            if idle_rounds > max_idle_rounds:
+                given_up = work.pending_units()
+                print(f'Workers leased no units {idle_rounds} times in a row, giving up {len(given_up)} units')
+                break
+            time.sleep(min(2 ** idle_rounds, 30))
+        else:
+            idle_rounds = 0
+
+    failed = work.failed_units() + given_up
+    work.close()
+    save_log(settings, process_hash, started, failed)
+    return process_hash
+
+
+def save_log(settings, process_hash, started, failed):
+    """
+    Save the total time and failed units of the crawl into the log and print time per profile
+    """
+    finished = datetime.datetime.utcnow()
+    client = pymongo.MongoClient(settings.get('MONGO_URI'))
+    logs = client[settings.get('MONGO_DB')][HouzzPipeline.logs_collection_name]
+    # hosts of the distributed crawl finish at different time, the log keeps the longest one
+    logs.update_one({'process_hash': process_hash},
+                    {'$max': {'total_spent_time': (finished - started).total_seconds()},
+                     '$set': {'failed_units': [list(u) for u in failed]}},
+                    upsert=True)
+    log = logs.find_one({'process_hash': process_hash})
+    client.close()
+
+    processed = log.get('profiles_added', 0)
+    if processed:
+        print(f"Time per profile: {log['total_spent_time'] / processed}")
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    if args.distributed:
+        run_distributed(args.pool, args.max_, args.start, args.unit, args.process_hash)
+    else:
+        run(args.pool, args.max_, args.start, args.unit, args.retries, args.process_hash)
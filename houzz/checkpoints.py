@@ -0,0 +1,72 @@
+"""
+Stores of API page offsets which are already crawled by the process with the given hash.
+A re-run with the same ``process_hash`` skips these pages
+"""
+import os
+import threading
+
+import pymongo
+
+
+class MongoCheckpointStore:
+    """
+    Keep done offsets in ``done_offsets`` field of the process document in ``logs`` collection
+    """
+    logs_collection_name = 'logs'
+
+    def __init__(self, mongo_uri, mongo_db, process_hash):
+        self.process_hash = process_hash
+        self.client = pymongo.MongoClient(mongo_uri)
+        self.collection = self.client[mongo_db][self.logs_collection_name]
+
+    def load(self):
+        """
+        :return: set of done offsets
+        """
+        log = self.collection.find_one({'process_hash': self.process_hash}, {'done_offsets': True})
+        if log is None:
+            return set()
+        return set(log.get('done_offsets', []))
+
+    def mark_done(self, offset):
+        self.collection.update_one({'process_hash': self.process_hash},
+                                   {'$addToSet': {'done_offsets': offset}}, upsert=True)
+
+    def close(self):
+        self.client.close()
+
+
+class FileCheckpointStore:
+    """
+    Append done offsets line by line to ``<CHECKPOINT_DIR>/<process_hash>.offsets``
+    """
+
+    def __init__(self, directory, process_hash):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{process_hash}.offsets')
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        :return: set of done offsets
+        """
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as f:
+            return {int(line) for line in f if line.strip()}
+
+    def mark_done(self, offset):
+        with self._lock, open(self.path, 'a') as f:
+            f.write(f'{offset}\n')
+
+    def close(self):
+        pass
+
+
+def checkpoint_store(settings, process_hash):
+    """
+    Create the store chosen by ``CHECKPOINT_BACKEND`` setting
+    """
+    if settings.get('CHECKPOINT_BACKEND', 'mongo') == 'file':
+        return FileCheckpointStore(settings.get('CHECKPOINT_DIR', 'checkpoints'), process_hash)
+    return MongoCheckpointStore(settings.get('MONGO_URI'), settings.get('MONGO_DB'), process_hash)
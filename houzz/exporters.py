@@ -0,0 +1,89 @@
+"""
+Writers of profile shards used by ``houzz.pipelines.ExportPipeline``: gzipped JSON lines and Parquet.
+"""
+import gzip
+import json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# columns of Parquet shards, the nested address is flattened into ``address_<field>``
+STRING_FIELDS = ('user_name', 'contact_name', 'activity_area', 'company_name', 'service_cost', 'website', 'email',
+                 'profile_url', 'phone_number', 'fingerprint')
+INT_FIELDS = ('reviews_count', 'projects_done_count')
+ADDRESS_FIELDS = ('prefecture', 'city', 'street', 'postal')
+
+
+class JsonLinesShard:
+    """
+    Gzipped file with one profile per line
+    """
+    extension = 'jsonl.gz'
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'xb')  # never overwrite the shard listed in the manifest
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode='wb')
+
+    def write_rows(self, rows):
+        data = ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in rows)
+        self.gzip.write(data.encode('utf-8'))
+        # the compressor keeps data until it's flushed, so the size wouldn't grow and the shard wouldn't be readable
+        self.gzip.flush()
+
+    @property
+    def size(self):
+        """
+        Compressed bytes written to the disk so far
+        """
+        return self.file.tell()
+
+    def close(self):
+        self.gzip.close()
+        self.file.close()
+
+
+class ParquetShard:
+    """
+    Parquet file, every batch of rows is written as a row group. Requires ``pyarrow``
+    """
+    extension = 'parquet'
+
+    def __init__(self, path):
+        self.schema = pyarrow.schema(
+            [(name, pyarrow.string()) for name in STRING_FIELDS] +
+            [(name, pyarrow.int64()) for name in INT_FIELDS] +
+            [('pro_rating', pyarrow.float64()), ('coordinates', pyarrow.list_(pyarrow.float64()))] +
+            [(f'address_{name}', pyarrow.string()) for name in ADDRESS_FIELDS]
+        )
+        self.path = path
+        self.file = open(path, 'xb')
+        self.writer = pyarrow.parquet.ParquetWriter(self.file, self.schema, compression='zstd')
+
+    def write_rows(self, rows):
+        columns = {name: [] for name in self.schema.names}
+        for row in rows:
+            address = row.get('address') or {}
+            for name in columns:
+                if name.startswith('address_'):
+                    columns[name].append(address.get(name[len('address_'):]))
+                else:
+                    columns[name].append(row.get(name))
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    @property
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+SHARD_CLASSES = {
+    'jsonl': JsonLinesShard,
+    'parquet': ParquetShard,
+}
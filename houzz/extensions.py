@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Define here the extensions of your project
+#
+# See documentation in:
+# https://doc.scrapy.org/en/latest/topics/extensions.html
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import listen_tcp
+from twisted.internet import task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from houzz.timing import BUCKETS, TIMINGS
+
+
+class MetricsResource(Resource):
+    """
+    Histograms of the stages in Prometheus text format
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+        lines = ['# TYPE houzz_stage_seconds histogram']
+        for stage, histogram in sorted(TIMINGS.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'houzz_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'houzz_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            lines.append(f'houzz_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class TimingExtension(object):
+    """
+    Export time histograms of the hot stages (spider callbacks, geo coding, phone formatting, saving to MongoDB)
+    into the stats every ``TIMING_EXPORT_INTERVAL`` seconds and serve them on
+    ``http://127.0.0.1:<port>/metrics``.
+
+    The port is the first free one of ``TIMING_PROMETHEUS_PORT`` range, as Scrapy chooses the telnet console port,
+    so every worker process of ``python -m houzz`` is served on its own port.
+    """
+    ports_count = 100  # size of the range when TIMING_PROMETHEUS_PORT is one port
+
+    def __init__(self, stats, interval, port):
+        self.stats = stats
+        self.interval = interval
+        self.port = port
+        self.export_task = None
+        self.listening_port = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('TIMING_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler.stats,
+                  interval=crawler.settings.getfloat('TIMING_EXPORT_INTERVAL', 30),
+                  port=crawler.settings.get('TIMING_PROMETHEUS_PORT') or None)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.export_task = task.LoopingCall(self.export)
+        self.export_task.start(self.interval, now=False)
+        if self.port is not None:
+            root = Resource()
+            root.putChild(b'metrics', MetricsResource())
+            self.listening_port = listen_tcp(self.port_range(), '127.0.0.1', Site(root))
+            port = self.listening_port.getHost().port
+            self.stats.set_value('timing/prometheus_port', port)
+            spider.logger.info(f'Timings are served on http://127.0.0.1:{port}/metrics')
+
+    def port_range(self):
+        """
+        :return: first and last ports of the range to listen on
+        """
+        ports = self.port.split(',') if isinstance(self.port, str) else self.port  # '9410,9420' from the command line
+        if isinstance(ports, (list, tuple)) and len(ports) > 1:
+            return [int(port) for port in ports]
+        first = int(ports[0] if isinstance(ports, (list, tuple)) else ports)
+        return [first, first + self.ports_count - 1]
+
+    def spider_closed(self, spider):
+        if self.export_task is not None and self.export_task.running:
+            self.export_task.stop()
+        self.export()
+        if self.listening_port is not None:
+            return self.listening_port.stopListening()
+
+    def export(self):
+        for stage, summary in TIMINGS.snapshot().items():
+            for name, value in summary.items():
+                self.stats.set_value(f'timing/{stage}/{name}', value)
@@ -0,0 +1,114 @@
+"""
+Extraction of profile pages by XPath expressions compiled once, instead of translating CSS queries
+and walking the whole tree for every field.
+"""
+import re
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+from houzz.items import inline, strip
+
+_translator = HTMLTranslator()
+
+
+def _compile(css):
+    """
+    Translate CSS query into compiled XPath. As ``Selector.css`` does, the query looks for the node itself
+    and its descendants, so it can be applied both to the root and to the already selected node
+
+    :param css: CSS query, ``::text`` and ``::attr(name)`` pseudo elements are supported
+    """
+    return etree.XPath(_translator.css_to_xpath(css), smart_strings=False)
+
+
+def _first(values):
+    """
+    The same as ``TakeFirst`` processor
+    """
+    for value in values:
+        if value is not None and value != '':
+            return value
+    return None
+
+
+class ProfilePageExtractor:
+    """
+    Extract fields of ``Profile`` from the profile page. The result is the same as ``ProfilesSpider.load_profile``
+    gives. Items of the info list are selected once and the fields are read from these nodes
+    """
+    info_items = _compile('.pro-info-horizontal-list .info-list-text')
+    info_text = _compile(':not(b)::text')
+    all_text = _compile('::text')
+    activity_area = _compile('[itemprop=child] [itemprop=title]::text')
+    postal = _compile('[itemprop=postalCode]::text')
+    prefecture = _compile('[itemprop=addressRegion]::text')
+    street = _compile('[itemprop=streetAddress]::text')
+    city = _compile('[itemprop=addressLocality] a::text')
+
+    phone_number = _compile('.pro-contact-methods .pro-contact-text::text')
+    website = _compile('.pro-contact-methods .proWebsiteLink::attr(href)')
+    company_name = _compile('a.profile-full-name::text')
+    pro_rating = _compile('.profile-title .pro-rating [itemprop=ratingValue]::attr(content)')
+    reviews_count = _compile('.profile-title .pro-rating [itemprop=reviewCount]::text')
+    projects_tab = _compile('a.sidebar-item-label[compid=projects_tab]')
+    href = _compile('::attr(href)')
+
+    word = re.compile(r'[\w ]+')
+    number = re.compile(r'\d+')
+
+    def extract(self, root):
+        """
+        :param root: lxml root of the page, i.e. ``response.selector.root``
+        :return: fields of ``Profile`` without ``user_name`` and ``profile_url`` as a plain dict
+        """
+        info = self.info_items(root)
+        fields = {}
+
+        contact_name = _first(m for text in self.info_text(info[1]) for m in self.word.findall(text))
+        activity_area = _first(v for node in info for v in self.activity_area(node))
+        postal = _first(v for node in info for v in self.postal(node))
+
+        address = {}
+        prefecture = _first(v for node in info for v in self.prefecture(node))
+        street = [v for node in info for v in self.street(node)]
+        city = _first(v for node in info for v in self.city(node))
+        if postal is not None:
+            address['postal'] = postal
+        if prefecture is not None:
+            address['prefecture'] = prefecture
+        if street:
+            address['street'] = ' '.join(street)
+        if city is not None:
+            address['city'] = city
+
+        service_cost = None
+        if len(info) > 4 and len(self.all_text(info[4])) > 2:
+            service_cost = ' '.join(inline(text) for text in self.all_text(info[4])[2:])
+
+        rating = _first(self.pro_rating(root))
+        reviews = _first(self.reviews_count(root))
+        values = (
+            ('contact_name', contact_name),
+            ('activity_area', activity_area),
+            ('phone_number', _first(self.phone_number(root))),
+            ('website', _first(self.website(root))),
+            ('address', address),
+            ('geo_query', postal),
+            ('company_name', _first(strip(text) for text in self.company_name(root))),
+            ('service_cost', service_cost),
+            ('pro_rating', float(rating) if rating is not None else None),
+            ('reviews_count', int(reviews) if reviews is not None else None),
+        )
+        for field, value in values:
+            if value is not None:
+                fields[field] = value
+        return fields
+
+    def projects(self, root):
+        """
+        :return: amount of projects from the sidebar or None, url of projects page
+        """
+        tab = self.projects_tab(root)[0]
+        count = [m for text in self.all_text(tab) for m in self.number.findall(text)]
+        return int(count[0]) if count else None, self.href(tab)[0]
@@ -0,0 +1,48 @@
+"""
+Fingerprints of profiles used by the incremental mode to skip profiles which aren't changed since the last run
+"""
+import hashlib
+import json
+
+import pymongo
+
+
+def fingerprint(data) -> str:
+    """
+    Compact hash of JSON serializable data
+
+    :param data: raw API JSON of the professional or fields of the profile
+    :return: 16 hex symbols
+    """
+    dump = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(dump.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class FingerprintStore:
+    """
+    Fingerprints of saved profiles keyed by user name. They are loaded once from ``profiles`` collection
+    and shared by the spider and the pipeline of the crawler
+    """
+    profile_collection_name = 'profiles'
+
+    def __init__(self, mongo_uri, mongo_db):
+        client = pymongo.MongoClient(mongo_uri)
+        cursor = client[mongo_db][self.profile_collection_name].find(
+            {'fingerprint': {'$exists': True}}, {'_id': False, 'user_name': True, 'fingerprint': True}
+        )
+        self.known = {doc['user_name']: doc['fingerprint'] for doc in cursor if 'user_name' in doc}
+        client.close()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        store = getattr(crawler, 'fingerprint_store', None)
+        if store is None:
+            store = cls(crawler.settings.get('MONGO_URI'), crawler.settings.get('MONGO_DB'))
+            crawler.fingerprint_store = store
+        return store
+
+    def is_unchanged(self, user_name, fp) -> bool:
+        return fp is not None and self.known.get(user_name) == fp
+
+    def update(self, user_name, fp):
+        self.known[user_name] = fp
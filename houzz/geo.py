@@ -0,0 +1,247 @@
+import csv
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from geopy import Nominatim
+from geopy.exc import GeocoderTimedOut
+
+from houzz.timing import timed
+
+
+class GeoCoderUnavailable(Exception):
+    """
+    The geo coder didn't answer because of timeout, rate limit or network error.
+    The query may have coordinates, so the result mustn't be cached as negative
+    """
+
+
+class GeoLocator:
+    """
+    Requests of all threads are spaced by ``min_interval`` seconds, public Nominatim allows one request per second
+    """
+
+    def __init__(self, timeout=5, min_interval=1.0):
+        self.geo_coder = None
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._rate_lock = threading.Lock()
+        self._next_request = 0.0
+
+    def _wait_turn(self):
+        """
+        Sleep until the next request is allowed. Every caller books its own moment, so threads don't wake up together
+        """
+        with self._rate_lock:
+            now = time.monotonic()
+            turn = max(now, self._next_request)
+            self._next_request = turn + self.min_interval
+        if turn > now:
+            time.sleep(turn - now)
+
+    @timed('geolocate')
+    def geolocate(self, query: str, default_code: str= 'JP'):
+        """
+        Processor to transform postal into coordinates on the Globe.
+
+        *NOTE*: Be careful because the function is depending on chosen geo driver very much.
+        Now it is set for use with Open Streets Map ``Nominatim`` driver.
+        The call is blocking, so run it outside of the reactor thread.
+
+        :param query: postal code
+        :param default_code: default country code to use
+        :return: geo longitude, geo.latitude, country_code
+        :raise GeoCoderUnavailable: if the geo coder failed to answer
+        """
+        with self._lock:
+            if not self.geo_coder:
+                self.geo_coder = Nominatim(country_bias=default_code)
+        self._wait_turn()
+        try:
+            geo = self.geo_coder.geocode(query, addressdetails=True, timeout=self.timeout)
+        except GeocoderTimedOut as e:
+            raise GeoCoderUnavailable(f'Timed out geo coding "{query}"') from e
+        except Exception as e:
+            raise GeoCoderUnavailable(f'Failed to geo code "{query}": {e}') from e
+        if not geo:
+            return None, default_code
+        return (geo.longitude, geo.latitude), geo.raw['address']['country_code']
+
+
+MISSING = object()  # marker of the value that isn't cached
+
+
+class GeoCache:
+    """
+    Two-tier cache of geo coder results keyed by ``(query, default_code)``.
+
+    The first tier is the in-process LRU, it must be used only from the reactor thread.
+    The second one is SQLite database on the disk which survives restarts and is shared between processes,
+    it is thread safe. Negative results (no coordinates) expire after ``negative_ttl`` seconds.
+    """
+
+    def __init__(self, size=10000, path=None, negative_ttl=86400):
+        self.size = size
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()
+        self._local = threading.local()
+
+    def get(self, key):
+        """
+        Return cached result from the memory or ``MISSING``
+        """
+        try:
+            result, expires = self._memory[key]
+        except KeyError:
+            return MISSING
+        if expires is not None and expires < time.time():
+            del self._memory[key]
+            return MISSING
+        self._memory.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """
+        Put the result into the memory evicting the least recently used one
+        """
+        expires = None if result[0] is not None else time.time() + self.negative_ttl
+        self._memory[key] = (result, expires)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.size:
+            self._memory.popitem(last=False)
+
+    def load(self, key):
+        """
+        Return result stored on the disk or ``MISSING``
+        """
+        if self.path is None:
+            return MISSING
+        row = self._connection().execute(
+            'SELECT lon, lat, country, created FROM geocodes WHERE query = ? AND bias = ?', (key[0], key[1] or '')
+        ).fetchone()
+        if row is None:
+            return MISSING
+        lon, lat, country, created = row
+        if lon is None:
+            if created + self.negative_ttl < time.time():
+                return MISSING
+            return None, country
+        return (lon, lat), country
+
+    def store(self, key, result):
+        """
+        Save the result on the disk
+        """
+        if self.path is None:
+            return
+        coordinates, country = result
+        lon, lat = coordinates if coordinates is not None else (None, None)
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?)',
+                         (key[0], key[1] or '', lon, lat, country, time.time()))
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        SQLite connections can't be shared between threads, so every thread has its own one
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                         'query TEXT, bias TEXT, lon REAL, lat REAL, country TEXT, created REAL, '
+                         'PRIMARY KEY (query, bias))')
+            self._local.conn = conn
+        return conn
+
+
+POSTAL_RE = re.compile(r'(?<!\d)(\d{3})-?(\d{4})(?!\d)')
+
+
+def postal_key(query: str):
+    """
+    Integer key of the postal code found in the query, i.e. 1500002 of ``'渋谷区, 東京都 150-0002'``
+
+    :return: key or None if there is no postal code
+    """
+    match = POSTAL_RE.search(query) if query else None
+    if match is None:
+        return None
+    return int(match.group(1) + match.group(2))
+
+
+class PostalCodeGeocoder:
+    """
+    Offline geo coder of postal codes by the table of their centroids.
+
+    Postal codes are kept as the sorted array of integer keys with the parallel arrays of coordinates,
+    so the table of all Japanese postals takes about 3 MB and the lookup is a binary search.
+    """
+
+    def __init__(self, keys: array, lons: array, lats: array, country: str):
+        self.keys = keys
+        self.lons = lons
+        self.lats = lats
+        self.country = country
+
+    @classmethod
+    def from_geonames(cls, path):
+        """
+        Load the postal codes dump of GeoNames, i.e. ``JP.txt`` of http://download.geonames.org/export/zip/.
+        Rows are tab separated: country code, postal code, place names and codes, latitude, longitude, accuracy.
+        The first centroid of the postal code is taken.
+        """
+        rows = {}
+        country = None
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                key = postal_key(row[1])
+                if key is None or key in rows:
+                    continue
+                rows[key] = (float(row[10]), float(row[9]))
+                country = country or row[0].lower()
+        keys = sorted(rows)
+        return cls(array('q', keys), array('d', (rows[key][0] for key in keys)),
+                   array('d', (rows[key][1] for key in keys)), country)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, query: str):
+        """
+        :param query: postal code or the location string ending with it
+        :return: ``((longitude, latitude), country_code)`` as ``GeoLocator.geolocate`` or None if it isn't found
+        """
+        key = postal_key(query)
+        if key is None:
+            return None
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return (self.lons[i], self.lats[i]), self.country
+
+    def lookup_many(self, queries):
+        """
+        Find the batch of queries, i.e. of the whole API page, by one pass over the table.
+        Keys are sorted, so every binary search starts from the position of the previous key
+
+        :return: list of results of ``lookup`` in the same order
+        """
+        found = [None] * len(queries)
+        keys = [(key, n) for n, key in enumerate(map(postal_key, queries)) if key is not None]
+        keys.sort()
+        i = 0
+        size = len(self.keys)
+        for key, n in keys:
+            i = bisect_left(self.keys, key, i)
+            if i == size:
+                break
+            if self.keys[i] == key:
+                found[n] = (self.lons[i], self.lats[i]), self.country
+        return found
@@ -0,0 +1,183 @@
+"""
+Geo queries over saved profiles by ``2dsphere`` index of their ``location`` field.
+
+    python -m houzz.geoquery radius --lon 139.70 --lat 35.69 --km 3
+    python -m houzz.geoquery bbox --west 139.6 --south 35.6 --east 139.8 --north 35.8
+    python -m houzz.geoquery regions --by address.prefecture
+    python -m houzz.geoquery regions --grid 0.5 --lon 139.70 --lat 35.69 --km 50
+    python -m houzz.geoquery backfill
+
+Found profiles are printed as JSON lines.
+"""
+import argparse
+import json
+import math
+
+import pymongo
+from pymongo.collection import Collection
+from pymongo.operations import UpdateOne
+from scrapy.utils.project import get_project_settings
+
+EARTH_RADIUS_KM = 6378.1
+
+
+def point(lon, lat) -> dict:
+    """
+    GeoJSON point of the coordinates
+    """
+    return {'type': 'Point', 'coordinates': [lon, lat]}
+
+
+def box(west, south, east, north) -> dict:
+    """
+    GeoJSON polygon of the bounding box
+    """
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north], [west, north],
+                                                 [west, south]]]}
+
+
+def circle(lon, lat, km) -> dict:
+    """
+    Operand of ``$geoWithin`` selecting the circle on the sphere
+    """
+    return {'$centerSphere': [[lon, lat], km / EARTH_RADIUS_KM]}
+
+
+def distance_km(lon1, lat1, lon2, lat2) -> float:
+    """
+    Great circle distance by the haversine formula
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GeoQuery:
+    """
+    Queries of ``profiles`` collection answered by its ``2dsphere`` index, made by ``HouzzPipeline.ensure_indexes``
+    """
+    profile_collection_name = 'profiles'
+    projection = {'_id': False, 'user_name': True, 'company_name': True, 'address': True, 'location': True,
+                  'pro_rating': True}
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    @classmethod
+    def from_settings(cls, settings):
+        client = pymongo.MongoClient(settings.get('MONGO_URI'))
+        return cls(client[settings.get('MONGO_DB')][cls.profile_collection_name])
+
+    def radius(self, lon, lat, km, limit=0):
+        """
+        Profiles within ``km`` kilometers from the point, the nearest first
+
+        :return: profiles with ``distance_km`` field
+        """
+        stages = [
+            {'$geoNear': {'near': point(lon, lat), 'distanceField': 'distance_km', 'maxDistance': km * 1000,
+                          'distanceMultiplier': 0.001, 'spherical': True}},
+            {'$project': dict(self.projection, distance_km=True)},
+        ]
+        if limit:
+            stages.append({'$limit': limit})
+        return self.collection.aggregate(stages)
+
+    def bbox(self, west, south, east, north, limit=0):
+        """
+        Profiles inside the bounding box
+        """
+        return self.collection.find({'location': {'$geoWithin': {'$geometry': box(west, south, east, north)}}},
+                                    self.projection, limit=limit)
+
+    def regions(self, by='address.prefecture', grid=None, within=None):
+        """
+        Amount of profiles and their average rating per region
+
+        :param by: field of the region
+        :param grid: size of square cells in degrees to group by instead of the field
+        :param within: operand of ``$geoWithin`` to take profiles from, i.e. ``circle(...)``,
+            the index is used to find them
+        :return: documents ``{'_id': region or [west, south] of the cell, 'count': ..., 'rating': ...}``
+        """
+        match = {'location': {'$geoWithin': within}} if within else {'location': {'$exists': True}}
+        if grid:
+            key = [{'$multiply': [{'$floor': {'$divide': [{'$arrayElemAt': ['$location.coordinates', i]}, grid]}},
+                                  grid]} for i in (0, 1)]
+        else:
+            key = f'${by}'
+        return self.collection.aggregate([
+            {'$match': match},
+            {'$group': {'_id': key, 'count': {'$sum': 1}, 'rating': {'$avg': '$pro_rating'}}},
+            {'$sort': {'count': pymongo.DESCENDING}},
+        ])
+
+    def backfill(self, batch_size=1000) -> int:
+        """
+        Set ``location`` of profiles saved with bare ``coordinates`` only
+
+        :return: amount of updated profiles
+        """
+        cursor = self.collection.find({'coordinates': {'$exists': True}, 'location': {'$exists': False}},
+                                      {'coordinates': True})
+        updated = 0
+        operations = []
+        for doc in cursor:
+            lon, lat = doc['coordinates']
+            operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'location': point(lon, lat)}}))
+            if len(operations) >= batch_size:
+                updated += self.collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += self.collection.bulk_write(operations, ordered=False).modified_count
+        return updated
+
+
+def get_arguments():
+    argp = argparse.ArgumentParser(prog='houzz.geoquery')
+    commands = argp.add_subparsers(dest='command')
+    commands.required = True
+
+    radius = commands.add_parser('radius', help='Profiles within the radius from the point, the nearest first')
+    radius.add_argument('--lon', required=True, type=float)
+    radius.add_argument('--lat', required=True, type=float)
+    radius.add_argument('--km', required=True, type=float)
+    radius.add_argument('--limit', default=0, type=int)
+
+    bbox = commands.add_parser('bbox', help='Profiles inside the bounding box')
+    for side in ('west', 'south', 'east', 'north'):
+        bbox.add_argument(f'--{side}', required=True, type=float)
+    bbox.add_argument('--limit', default=0, type=int)
+
+    regions = commands.add_parser('regions', help='Amount of profiles and average rating per region')
+    regions.add_argument('--by', default='address.prefecture', help='Field of the region')
+    regions.add_argument('--grid', default=None, type=float, help='Group by square cells of that degrees instead')
+    regions.add_argument('--lon', type=float, help='Take only profiles within --km from the point')
+    regions.add_argument('--lat', type=float)
+    regions.add_argument('--km', type=float)
+
+    commands.add_parser('backfill', help='Set location of profiles saved before it was introduced')
+    return argp.parse_args()
+
+
+def main():
+    args = get_arguments()
+    query = GeoQuery.from_settings(get_project_settings())
+    if args.command == 'radius':
+        docs = query.radius(args.lon, args.lat, args.km, args.limit)
+    elif args.command == 'bbox':
+        docs = query.bbox(args.west, args.south, args.east, args.north, args.limit)
+    elif args.command == 'regions':
+        within = None
+        if args.km is not None:
+            within = circle(args.lon, args.lat, args.km)
+        docs = query.regions(args.by, args.grid, within)
+    else:
+        print(f'{query.backfill()} profiles updated')
+        return
+    for doc in docs:
+        print(json.dumps(doc, ensure_ascii=False, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Storage of ``HttpCacheMiddleware`` keeping all responses of the spider in one append-only segment file
+and the policy which doesn't cache failed API pages.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import re
+import struct
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+
+# record is the header, the key and the compressed response
+MAGIC = b'HZC1'
+HEADER = struct.Struct('<4sHId')  # magic, key size, data size, timestamp
+
+ACK_RE = re.compile(rb'"Ack"\s*:\s*"([^"]*)"')
+
+
+def cache_key(request, volatile_params=()) -> bytes:
+    """
+    Key of the request by its method and URL, query parameters are sorted and the volatile ones are dropped,
+    so they don't make new cache entries
+    """
+    parts = urlsplit(request.url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name not in volatile_params)
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+    return hashlib.sha1(f'{request.method} {url}'.encode('utf-8')).hexdigest().encode('ascii')
+
+
+class AckCachePolicy(DummyPolicy):
+    """
+    Cache every response except statuses of ``HTTPCACHE_IGNORE_HTTP_CODES`` and API pages
+    whose ``Ack`` isn't ``Success``, so bans and failed pages aren't replayed until they expire
+    """
+
+    def should_cache_response(self, response, request):
+        if not super().should_cache_response(response, request):
+            return False
+        match = ACK_RE.search(response.body)
+        return match is None or match.group(1) == b'Success'
+
+
+class SegmentCacheStorage(object):
+    """
+    Responses are compressed by zlib and appended to ``<HTTPCACHE_DIR>/<spider name>.segment``.
+    The index of the file is built when the spider opens, reads are made by the memory map of the file.
+    Appends are made under the exclusive lock of the file, so several processes can share it. Records
+    appended by other processes are indexed when the key isn't found.
+
+    Responses expire by ``HTTPCACHE_TTLS`` per callback name of the request or by ``HTTPCACHE_EXPIRATION_SECS``.
+    Expired and replaced records stay in the file until it's deleted.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.ttls = settings.getdict('HTTPCACHE_TTLS')
+        self.volatile_params = set(settings.getlist('HTTPCACHE_VOLATILE_PARAMS'))
+        self.compress_level = settings.getint('HTTPCACHE_COMPRESS_LEVEL', 6)
+        self.path = None
+        self.file = None
+        self.map = None
+        self.index = {}  # key -> (data offset, data size, timestamp)
+        self.indexed = 0  # end of the last indexed record
+
+    def open_spider(self, spider):
+        self.path = os.path.join(self.cachedir, f'{spider.name}.segment')
+        self.file = open(self.path, 'a+b')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        try:
+            self._scan()
+            if self.indexed < os.fstat(self.file.fileno()).st_size:
+                # tail of the record which wasn't written completely
+                self.file.truncate(self.indexed)
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        spider.logger.debug(f'Using segment cache storage {self.path} with {len(self.index)} responses')
+
+    def close_spider(self, spider):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def retrieve_response(self, spider, request):
+        key = cache_key(request, self.volatile_params)
+        entry = self.index.get(key)
+        if entry is None and os.fstat(self.file.fileno()).st_size > self.indexed:
+            self._scan()
+            entry = self.index.get(key)
+        if entry is None:
+            return None
+
+        offset, size, timestamp = entry
+        ttl = self._ttl(request)
+        if 0 < ttl < time.time() - timestamp:
+            return None
+
+        url, status, headers, body = pickle.loads(zlib.decompress(self._read(offset, size)))
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        key = cache_key(request, self.volatile_params)
+        timestamp = time.time()
+        data = zlib.compress(pickle.dumps((response.url, response.status, dict(response.headers), response.body),
+                                          protocol=4), self.compress_level)
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        try:
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(HEADER.pack(MAGIC, len(key), len(data), timestamp) + key + data)
+            self.file.flush()
+        finally:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.index[key] = (offset + HEADER.size + len(key), len(data), timestamp)
+
+    def _ttl(self, request):
+        callback = getattr(request.callback, '__name__', 'parse')
+        return int(self.ttls.get(callback, self.expiration_secs))
+
+    def _read(self, offset, size):
+        """
+        Read the data by the memory map, which is made again when the file has grown past it
+        """
+        if self.map is None or offset + size > len(self.map):
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + size]
+
+    def _scan(self):
+        """
+        Index records after the last indexed one, later records of the same key replace earlier ones
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        offset = self.indexed
+        self.file.seek(offset)
+        while offset + HEADER.size <= size:
+            magic, key_size, data_size, timestamp = HEADER.unpack(self.file.read(HEADER.size))
+            end = offset + HEADER.size + key_size + data_size
+            if magic != MAGIC or end > size:
+                break
+            key = self.file.read(key_size)
+            self.index[key] = (offset + HEADER.size + key_size, data_size, timestamp)
+            self.file.seek(data_size, os.SEEK_CUR)
+            offset = end
+        self.indexed = offset
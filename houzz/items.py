@@ -4,11 +4,16 @@
 #
 # See documentation in:
 # https://doc.scrapy.org/en/latest/topics/items.html
+from urllib.parse import urlparse
+
 import phonenumbers
 import scrapy
+from scrapy.exceptions import DropItem
 from scrapy.loader import ItemLoader
 from scrapy.loader.processors import TakeFirst, MapCompose, Join
 
+from houzz.timing import timed
+
 
 def strip(text):
     """
@@ -29,6 +34,21 @@ def inline(text):
     return text.replace('\t', ' ').replace('\n', '. ')
 
 
+def user_name_from_url(url: str) -> str:
+    """
+    Extract Houzz user name from the profile url, i.e. 'https://www.houzz.jp/pro/some-name/company' -> 'some-name'
+
+    :param url: url of the profile page
+    :return: user name or None if url isn't the profile one
+    """
+    parts = urlparse(url).path.split('/')
+    try:
+        return parts[parts.index('pro') + 1] or None
+    except (ValueError, IndexError):
+        return None
+
+
+@timed('format_phone')
 def format_phone(phone: str, country_code: str) -> str:
     """
     Format given phone number in E164
@@ -60,11 +80,17 @@ class ProfileLoader(ItemLoader):
 
 
 class Profile(scrapy.Item):
+    """
+    Schema of the profile. Item loaders fill ``Profile`` items, while the fast paths give plain dicts
+    with the same keys, which pass through the pipelines without copies
+    """
+    user_name = scrapy.Field()  # unique Houzz user name of the professional
     activity_area = scrapy.Field()
     contact_name = scrapy.Field()
 
     address = scrapy.Field()
-    coordinates = scrapy.Field()
+    coordinates = scrapy.Field()  # [longitude, latitude]
+    location = scrapy.Field()  # GeoJSON point of the coordinates, indexed by ``2dsphere`` index
 
     company_name = scrapy.Field()
     service_cost = scrapy.Field()
@@ -79,6 +105,22 @@ class Profile(scrapy.Item):
     phone_number = scrapy.Field()
     pro_rating = scrapy.Field()
 
+    geo_query = scrapy.Field()  # postal or location string, consumed by ``GeoPipeline``
+    fingerprint = scrapy.Field()  # hash of the source data, used by the incremental mode
+
+
+def as_dict(item) -> dict:
+    """
+    Fields of the profile, the plain dict of the fast paths is returned as it is without a copy
+    """
+    return item if type(item) is dict else dict(item)
+
+
+class ItemNotSaved(DropItem):
+    """
+    The item is finished by the pipelines but isn't persisted, so its page must be crawled again
+    """
+
 
 class Address(scrapy.Item):
     prefecture = scrapy.Field(
@@ -93,3 +135,50 @@ class Address(scrapy.Item):
     postal = scrapy.Field(
         output_processor=TakeFirst()
     )  #
+
+
+# API field of the professional -> profile field, converter. Converters repeat ``ProfileLoader`` processors
+API_PROFILE_FIELDS = (
+    ('ServicesProvided', 'activity_area', None),
+    ('WebSite', 'website', None),
+    ('Email', 'email', None),
+    ('Location', 'geo_query', None),
+    ('Phone', 'phone_number', None),
+    ('UserDisplayName', 'company_name', None),
+    ('CostEstimateDescription', 'service_cost', inline),
+    ('ReviewRating', 'pro_rating', float),
+    ('ReviewCount', 'reviews_count', int),
+)
+
+# API field of the professional -> address field
+API_ADDRESS_FIELDS = (
+    ('Zip', 'postal'),
+    ('State', 'prefecture'),
+    ('Address', 'street'),
+    ('City', 'city'),
+)
+
+
+def profile_from_api(prof: dict) -> dict:
+    """
+    Build the profile from API data of one professional by plain dict lookups. The result has the same fields
+    as the item loaders give, empty values are skipped
+
+    :param prof: element of ``Professionals`` list of API page
+    """
+    info = prof['Professional']
+    fields = {'user_name': prof['UserName'], 'contact_name': prof['UserName']}
+
+    for key, field, convert in API_PROFILE_FIELDS:
+        value = info.get(key)
+        if value is not None and value != '':
+            fields[field] = convert(value) if convert is not None else value
+
+    address = {}
+    for key, field in API_ADDRESS_FIELDS:
+        value = info.get(key)
+        if value is not None and (value != '' or field == 'street'):
+            address[field] = value
+    fields['address'] = address
+
+    return fields
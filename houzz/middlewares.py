@@ -5,8 +5,14 @@
 # See documentation in:
 # https://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
+import random
+import time
+
 from scrapy import signals
+from scrapy.http import Request
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
+from twisted.internet import reactor
 
 from houzz.spiders import ProfilesSpider
 
@@ -81,8 +87,6 @@ class HouzzDownloaderMiddleware(object):
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
-        spider.stats.set_value('retry_times', spider.stats.get_value('retry_times', 0)
-                               + request.meta.get('retry_times', 0))
         return None
 
     def process_response(self, request, response, spider):
@@ -106,3 +110,230 @@ class HouzzDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class BackoffRetryMiddleware(RetryMiddleware):
+    """
+    Retry middleware which waits before sending the retry and gives up early on statuses
+    which won't be fixed by retrying.
+
+    The wait is exponential by the number of the retry, ``RETRY_BACKOFF_BASE * 2 ** (retry - 1)`` seconds
+    bounded by ``RETRY_BACKOFF_MAX``, with full jitter. The retry request is held out of the downloader meanwhile,
+    so it doesn't take a slot of ``CONCURRENT_REQUESTS``, and it's passed to the engine when the wait is over.
+    The failed request is ignored with ``retry_scheduled`` meta set, so its errback knows the retry is coming.
+
+    ``RETRY_BUDGETS`` maps the response status to the max amount of its retries, 0 means no retries.
+    Statuses with positive budgets are retried even if they aren't in ``RETRY_HTTP_CODES``
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.budgets = {int(status): int(budget) for status, budget in settings.getdict('RETRY_BUDGETS').items()}
+        self.retry_http_codes |= {status for status, budget in self.budgets.items() if budget > 0}
+        self.backoff_base = settings.getfloat('RETRY_BACKOFF_BASE', 0.5)
+        self.backoff_max = settings.getfloat('RETRY_BACKOFF_MAX', 30)
+        self.crawler = None
+        self.held = set()  # delayed calls passing the held retries to the engine
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.settings)
+        middleware.crawler = crawler
+        crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_response(self, request, response, spider):
+        if request.meta.get('dont_retry', False) or response.status not in self.retry_http_codes:
+            return response
+        request.meta['max_retry_times'] = self.budgets.get(response.status, self.max_retry_times)
+        result = super().process_response(request, response, spider)
+        if result is response:
+            spider.crawler.stats.inc_value(f'retry/given_up/{response.status}')
+        return self._backoff(request, result, spider)
+
+    def process_exception(self, request, exception, spider):
+        return self._backoff(request, super().process_exception(request, exception, spider), spider)
+
+    def _backoff(self, request, result, spider):
+        """
+        Hold the retry request for the backoff and ignore the failed one
+        """
+        if not isinstance(result, Request):
+            return result
+        ceiling = min(self.backoff_base * 2 ** (result.meta['retry_times'] - 1), self.backoff_max)
+        delay = random.uniform(0, ceiling)
+        spider.crawler.stats.inc_value('retry/backoff_ms', int(delay * 1000))
+        self.held.add(reactor.callLater(delay, self._resume, result, spider))
+        request.meta['retry_scheduled'] = True
+        raise IgnoreRequest(f'Retry of {request} is held for {delay:.2f} seconds')
+
+    def _resume(self, request, spider):
+        self.held = {call for call in self.held if call.active()}
+        self.crawler.engine.crawl(request, spider)
+
+    def spider_idle(self, spider):
+        if any(call.active() for call in self.held):
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        for call in self.held:
+            if call.active():
+                call.cancel()
+
+
+class ProxyState(object):
+    """
+    Concurrency, delay and health of one proxy of ``ProxyPoolMiddleware``
+    """
+
+    def __init__(self, index, address, concurrency, delay):
+        self.index = index
+        self.address = address
+        self.slot = f'proxy-{index}'
+        self.concurrency = concurrency
+        self.delay = delay
+        self.inflight = 0
+        self.failures = 0  # consecutive errors and bans
+        self.retired_until = 0
+
+    @property
+    def free(self):
+        return int(self.concurrency) - self.inflight
+
+
+class ProxyPoolMiddleware(object):
+    """
+    Spread requests over the proxies of ``PROXY_LIST`` and find how much each of them tolerates.
+
+    Every proxy has its own download slot. Its concurrency grows by one per window of fast successful responses
+    and the delay shrinks, while a ban, an error or a response slower than ``PROXY_TARGET_LATENCY``
+    halves the concurrency and doubles the delay (AIMD). A proxy failed ``PROXY_RETIRE_AFTER`` times in a row
+    isn't used for ``PROXY_RETIRE_TIME`` seconds.
+
+    Requests with the proxy set by the spider are left as they are.
+    """
+
+    def __init__(self, crawler, proxies, min_concurrency=1, max_concurrency=16, start_concurrency=2,
+                 max_delay=10, target_latency=2.0, ban_statuses=(403, 429, 503), retire_after=5, retire_time=300):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.start_concurrency = start_concurrency
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.ban_statuses = set(ban_statuses)
+        self.retire_after = retire_after
+        self.retire_time = retire_time
+        self.proxies = [ProxyState(i, address, start_concurrency, 0) for i, address in enumerate(proxies)]
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        proxies = crawler.settings.getlist('PROXY_LIST')
+        if not proxies:
+            raise NotConfigured('PROXY_LIST is empty')
+        return cls(
+            crawler, proxies,
+            min_concurrency=crawler.settings.getint('PROXY_MIN_CONCURRENCY', 1),
+            max_concurrency=crawler.settings.getint('PROXY_MAX_CONCURRENCY', 16),
+            start_concurrency=crawler.settings.getint('PROXY_START_CONCURRENCY', 2),
+            max_delay=crawler.settings.getfloat('PROXY_MAX_DELAY', 10),
+            target_latency=crawler.settings.getfloat('PROXY_TARGET_LATENCY', 2.0),
+            ban_statuses=[int(x) for x in crawler.settings.getlist('PROXY_BAN_STATUSES', [403, 429, 503])],
+            retire_after=crawler.settings.getint('PROXY_RETIRE_AFTER', 5),
+            retire_time=crawler.settings.getfloat('PROXY_RETIRE_TIME', 300)
+        )
+
+    def process_request(self, request, spider):
+        if request.meta.get('proxy') and 'proxy_index' not in request.meta:
+            return None  # chosen by the spider
+
+        proxy = self.choose()
+        if request.meta.get('proxy_index') != proxy.index:
+            # the retry goes through another proxy, ``HttpProxyMiddleware`` keeps the header if it's there,
+            # so credentials of the previous proxy would be sent to the new one
+            request.headers.pop('Proxy-Authorization', None)
+        request.meta['proxy'] = proxy.address
+        request.meta['proxy_index'] = proxy.index
+        request.meta['download_slot'] = proxy.slot
+        proxy.inflight += 1
+        self._apply(proxy)
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = self._release(request)
+        if proxy is not None:
+            if response.status in self.ban_statuses:
+                self.stats.inc_value('proxy/bans')
+                self._failed(proxy, spider)
+            else:
+                self._succeeded(proxy, request.meta.get('download_latency', 0))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = self._release(request)
+        if proxy is not None:
+            self.stats.inc_value('proxy/errors')
+            self._failed(proxy, spider)
+
+    def choose(self) -> ProxyState:
+        """
+        Take the working proxy with the most free capacity. If all of them are retired take the one
+        which returns first
+        """
+        now = time.time()
+        working = [proxy for proxy in self.proxies if proxy.retired_until <= now]
+        if not working:
+            return min(self.proxies, key=lambda proxy: proxy.retired_until)
+        return max(working, key=lambda proxy: proxy.free)
+
+    def _release(self, request):
+        index = request.meta.get('proxy_index')
+        if index is None:
+            return None
+        proxy = self.proxies[index]
+        proxy.inflight = max(proxy.inflight - 1, 0)
+        return proxy
+
+    def _succeeded(self, proxy: ProxyState, latency):
+        if latency > self.target_latency:
+            self._decrease(proxy)
+            return
+        proxy.failures = 0
+        # additive increase: one more concurrent request per ``concurrency`` fast responses
+        proxy.concurrency = min(proxy.concurrency + 1 / proxy.concurrency, self.max_concurrency)
+        proxy.delay = proxy.delay / 2 if proxy.delay > 0.05 else 0
+        self._apply(proxy)
+
+    def _failed(self, proxy: ProxyState, spider):
+        if proxy.retired_until > time.time():
+            return  # requests sent before the retirement
+        proxy.failures += 1
+        self._decrease(proxy)
+        if proxy.failures >= self.retire_after:
+            proxy.retired_until = time.time() + self.retire_time
+            proxy.failures = 0
+            # requests queued in its slot are let through without delay, they are retried by other proxies
+            proxy.concurrency = self.start_concurrency
+            proxy.delay = 0
+            self._apply(proxy)
+            self.stats.inc_value('proxy/retired')
+            spider.logger.warning(f'Proxy {proxy.index} is retired for {self.retire_time} seconds')
+
+    def _decrease(self, proxy: ProxyState):
+        proxy.concurrency = max(proxy.concurrency / 2, self.min_concurrency)
+        proxy.delay = min(max(proxy.delay * 2, 0.25), self.max_delay)
+        self._apply(proxy)
+
+    def _apply(self, proxy: ProxyState):
+        """
+        Pass the concurrency and the delay of the proxy to its download slot. The slot is created by the downloader
+        on the first request, so it's applied again on every response
+        """
+        slot = self.crawler.engine.downloader.slots.get(proxy.slot)
+        if slot is not None:
+            slot.concurrency = int(proxy.concurrency)
+            slot.delay = proxy.delay
+        self.stats.set_value(f'proxy/{proxy.index}/concurrency', int(proxy.concurrency))
+        self.stats.set_value(f'proxy/{proxy.index}/delay_ms', int(proxy.delay * 1000))
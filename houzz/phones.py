@@ -0,0 +1,38 @@
+"""
+Phone normalization with LRU cache. Offices share phone numbers and pages repeat professionals,
+so the same ``(raw, country)`` pairs are parsed many times.
+
+``phonenumberslite`` is used: it has no geocoding and carrier data, and the metadata of a region is loaded
+on the first number of this region, so only the regions met in the crawl are loaded.
+"""
+import functools
+
+from phonenumbers import NumberParseException
+
+from houzz.items import format_phone
+
+
+class PhoneNormalizer:
+    def __init__(self, cache_size=8192):
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._normalize)
+
+    @staticmethod
+    def _normalize(raw, country):
+        try:
+            return format_phone(raw, country)
+        except NumberParseException:
+            return raw
+
+    def normalize(self, raw: str, country: str) -> str:
+        """
+        Format the phone in E164 or return it as is if it can't be parsed
+
+        :param raw: unformatted phone number
+        :param country: country code of the phone number
+        """
+        if not raw or country is None:
+            return raw
+        return self._cached(raw, country.upper())
+
+    def cache_info(self):
+        return self._cached.cache_info()
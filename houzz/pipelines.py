@@ -5,75 +5,743 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 import datetime
+import json
+import os
+import queue
+import threading
+import time
+
 import pymongo
 import scrapy.crawler
 from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from pymongo.operations import UpdateOne
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, reactor, task, threads
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
 
+from houzz import exporters
+from houzz.fingerprints import FingerprintStore
+from houzz.geo import GeoLocator, GeoCache, GeoCoderUnavailable, MISSING, PostalCodeGeocoder
+from houzz.geoquery import point
+from houzz.items import ItemNotSaved, as_dict
+from houzz.phones import PhoneNormalizer
 from houzz.spiders import ProfilesSpider, APISpider
+from houzz.timing import TIMINGS, timed
+
+
+class DedupePipeline(object):
+    """
+    Drop profiles which were already saved by this or other workers of the same process hash,
+    before they are geo coded and saved again.
+
+    Workers share ``seen`` collection of MongoDB with documents ``{'_id': '<process_hash>:<user_name>'}``
+    which expire after ``DEDUPE_TTL`` seconds. The worker claims the profile before it's processed and marks
+    the claim saved when the item has passed all pipelines. Only saved profiles are dropped, the claim which isn't
+    saved, i.e. its worker crashed or failed to write it, is taken over, so the resumed crawl saves the profile.
+    Without the process hash profiles are deduplicated only inside the process
+    """
+    seen_collection_name = 'seen'
+    client_class = pymongo.MongoClient
+
+    def __init__(self, stats, mongo_uri, mongo_db, ttl=7 * 24 * 60 * 60):
+        self.stats = stats
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.ttl = ttl
+        self.seen = set()  # user names seen by this process
+        self.saved = []  # user names saved since the last update of their claims
+        self.client = None
+        self.seen_collection = None
+        self.process_hash = None
+        self.mark_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler: scrapy.crawler.Crawler):
+        pipeline = cls(
+            stats=crawler.stats,
+            mongo_uri=crawler.settings.get('MONGO_URI'),
+            mongo_db=crawler.settings.get('MONGO_DB'),
+            ttl=crawler.settings.getint('DEDUPE_TTL', 7 * 24 * 60 * 60)
+        )
+        crawler.signals.connect(pipeline.item_saved, signal=signals.item_scraped)
+        crawler.signals.connect(pipeline.item_dropped, signal=signals.item_dropped)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.process_hash = getattr(spider, 'process_hash', None)
+        if self.process_hash is None:
+            return
+        self.client = self.client_class(self.mongo_uri)
+        self.seen_collection: Collection = self.client[self.mongo_db][self.seen_collection_name]
+        d = threads.deferToThread(self.seen_collection.create_index, 'created', expireAfterSeconds=self.ttl)
+        d.addErrback(lambda f: spider.logger.error(f'TTL index of seen profiles wasn\'t created: {f.value}'))
+        self.mark_task = task.LoopingCall(self.mark_saved)
+        self.mark_task.start(1, now=False)
+
+    def close_spider(self, spider):
+        if self.client is None:
+            return
+        if self.mark_task.running:
+            self.mark_task.stop()
+        d = self.mark_saved()
+        d.addBoth(lambda _: self.client.close())
+        return d
+
+    def process_item(self, item, spider):
+        user_name = item.get('user_name')
+        if not user_name:
+            return item  # it can't be told from other profiles, ``HouzzPipeline`` drops it
+        if user_name in self.seen:
+            self.stats.inc_value('dedupe/local_skipped')
+            raise DropItem(f'Profile "{user_name}" is already processed by this worker')
+        self.seen.add(user_name)
+
+        if self.seen_collection is None:
+            return item
+        d = threads.deferToThread(self.claim, user_name)
+        d.addCallback(self._claimed, item)
+        return d
+
+    def claim(self, user_name) -> bool:
+        """
+        Claim the profile for this worker. The claim of another worker is taken over if it isn't saved
+
+        :return: False if the profile is already saved by another worker
+        """
+        try:
+            self.seen_collection.update_one(
+                {'_id': f'{self.process_hash}:{user_name}', 'saved': {'$ne': True}},
+                {'$set': {'saved': False, 'created': datetime.datetime.utcnow()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False  # the saved claim doesn't match the filter, so the upsert collides with it
+        return True
+
+    def _claimed(self, claimed, item):
+        if not claimed:
+            self.stats.inc_value('dedupe/shared_skipped')
+            raise DropItem(f'Profile "{item["user_name"]}" is already saved by another worker')
+        return item
+
+    def item_saved(self, item, response, spider):
+        if self.seen_collection is not None and item.get('user_name'):
+            self.saved.append(item['user_name'])
+
+    def item_dropped(self, item, response, exception, spider):
+        if isinstance(exception, ItemNotSaved):
+            self.seen.discard(item.get('user_name'))  # the next copy of the profile may be saved
+
+    def mark_saved(self):
+        """
+        Mark claims of the saved profiles by one write
+        """
+        if not self.saved:
+            return defer.succeed(None)
+        ids = [f'{self.process_hash}:{user_name}' for user_name in self.saved]
+        self.saved = []
+        d = threads.deferToThread(self.seen_collection.update_many, {'_id': {'$in': ids}}, {'$set': {'saved': True}})
+        d.addErrback(lambda f: self.stats.inc_value('dedupe/mark_errors'))
+        return d
+
+
+class GeoPipeline(object):
+    """
+    Resolve ``geo_query`` of the item into coordinates and format the phone number with the found country code.
+
+    Geo coder requests are blocking, so they are made in a bounded thread pool and the item is finished
+    when the coordinates arrive. Meanwhile the reactor keeps downloading. Requests to the geo coder itself
+    are spaced by ``GEO_MIN_INTERVAL`` seconds, the threads mostly overlap the disk cache lookups.
+    Results are cached by ``GeoCache`` and concurrent lookups of the same query share one request.
+
+    With ``GEO_BACKEND = 'postal'`` queries are looked up in the local postal table firstly, all queries of the page
+    together, and only the missing ones go to the geo coder. The table has postals of one country,
+    so ``geo_bias`` of the spider must be that country.
+    """
+
+    def __init__(self, stats, threads_count, cache: GeoCache, phones: PhoneNormalizer,
+                 postal: PostalCodeGeocoder = None, min_interval=1.0):
+        self.stats = stats
+        self.threads_count = threads_count
+        self.cache = cache
+        self.phones = phones
+        self.postal = postal
+        self.locator = GeoLocator(min_interval=min_interval)
+        self.spider = None
+        self.pool = None
+        self._waiting = {}  # query key -> deferreds waiting for the running lookup
+        self._postal_batch = []  # query keys and their deferreds waiting for the postal table
+
+    @classmethod
+    def from_crawler(cls, crawler: scrapy.crawler.Crawler):
+        settings = crawler.settings
+        backend = settings.get('GEO_BACKEND', 'nominatim')
+        postal = None
+        if backend == 'postal':
+            if not settings.get('GEO_POSTAL_TABLE'):
+                raise ValueError('GEO_POSTAL_TABLE is required by GEO_BACKEND = "postal"')
+            postal = PostalCodeGeocoder.from_geonames(settings.get('GEO_POSTAL_TABLE'))
+            crawler.stats.set_value('geocode/postal_table_size', len(postal))
+        elif backend != 'nominatim':
+            raise ValueError(f'Unknown GEO_BACKEND "{backend}"')
+        return cls(
+            stats=crawler.stats,
+            threads_count=settings.getint('GEO_THREADS', 4),
+            cache=GeoCache(size=settings.getint('GEO_CACHE_SIZE', 10000),
+                           path=settings.get('GEO_CACHE_PATH'),
+                           negative_ttl=settings.getint('GEO_NEGATIVE_TTL', 86400)),
+            phones=PhoneNormalizer(settings.getint('PHONE_CACHE_SIZE', 8192)),
+            postal=postal,
+            min_interval=settings.getfloat('GEO_MIN_INTERVAL', 1.0)
+        )
+
+    def open_spider(self, spider):
+        if self.postal is not None and (spider.geo_bias or '').lower() != self.postal.country:
+            # the table would never be consulted and every postal would go to the geo coder
+            raise ValueError(f'GEO_POSTAL_TABLE has postals of "{self.postal.country}", but geo bias of the spider '
+                             f'is "{spider.geo_bias}", set GEO_BIAS to the country of the table')
+        self.spider = spider
+        self.pool = ThreadPool(minthreads=1, maxthreads=self.threads_count, name='geo')
+        self.pool.start()
+
+    def close_spider(self, spider):
+        self.pool.stop()
+        info = self.phones.cache_info()
+        self.stats.set_value('phone/cache_hits', info.hits)
+        self.stats.set_value('phone/cache_misses', info.misses)
+
+    def process_item(self, item, spider: ProfilesSpider):
+        query = item.pop('geo_query', None)
+        if not query:
+            return self._fill_item((None, spider.geo_bias), item)
+        key = (query, spider.geo_bias)
+        d = self._lookup(key) if self.postal is None else self._lookup_postal(key)
+        d.addCallback(self._fill_item, item)
+        return d
+
+    def _lookup_postal(self, key):
+        """
+        Queue the query for the postal table. Items of the page are processed in one reactor turn,
+        so their queries are looked up together on the next one
+        """
+        d = defer.Deferred()
+        if not self._postal_batch:
+            reactor.callLater(0, self._flush_postal)
+        self._postal_batch.append((key, d))
+        return d
+
+    def _flush_postal(self):
+        """
+        Look up the queued queries in the postal table and pass the missing ones to the geo coder
+        """
+        batch, self._postal_batch = self._postal_batch, []
+        results = self.postal.lookup_many([key[0] for key, _ in batch])
+        self.stats.inc_value('geocode/postal_batches')
+        for (key, d), result in zip(batch, results):
+            if result is None:
+                self.stats.inc_value('geocode/postal_miss')
+                self._lookup(key).chainDeferred(d)
+            else:
+                self.stats.inc_value('geocode/postal_hit')
+                d.callback(result)
+
+    def _lookup(self, key):
+        """
+        Find coordinates of the query firstly in the memory, then on the disk and finally with the geo coder
+        """
+        result = self.cache.get(key)
+        if result is not MISSING:
+            self.stats.inc_value('geocode/memory_hit')
+            return defer.succeed(result)
+
+        if key in self._waiting:
+            self.stats.inc_value('geocode/coalesced')
+            d = defer.Deferred()
+            self._waiting[key].append(d)
+            return d
+
+        self._waiting[key] = []
+        d = threads.deferToThreadPool(reactor, self.pool, self._resolve, key)
+        d.addBoth(self._release, key)
+        return d
+
+    def _resolve(self, key):
+        """
+        Runs in the thread pool
+
+        :return: result, where it was found, time spent in seconds
+        """
+        started = time.time()
+        result = self.cache.load(key)
+        if result is not MISSING:
+            return result, 'disk', time.time() - started
+        try:
+            result = self.locator.geolocate(*key)
+        except GeoCoderUnavailable as e:
+            self.spider.logger.warning(str(e))
+            return (None, key[1]), 'error', time.time() - started
+        self.cache.store(key, result)
+        return result, 'remote', time.time() - started
+
+    def _release(self, resolved, key):
+        """
+        Save the result into the memory and pass it to the coalesced lookups
+        """
+        waiting = self._waiting.pop(key)
+        if isinstance(resolved, Failure):
+            for d in waiting:
+                d.errback(resolved)
+            return resolved
+
+        result, source, spent = resolved
+        if source == 'error':
+            self.stats.inc_value('geocode/errors')
+        else:
+            self.stats.inc_value(f'geocode/{source}_hit' if source == 'disk' else 'geocode/miss')
+            self.stats.inc_value(f'geocode/{source}_time_ms', int(spent * 1000))
+            self.stats.max_value(f'geocode/{source}_max_time_ms', int(spent * 1000))
+            self.cache.put(key, result)  # failed lookup isn't cached, so the next item asks again
+        for d in waiting:
+            d.callback(result)
+        return result
+
+    def _fill_item(self, result, item):
+        """
+        Set found coordinates into the item and format its phone number
+        """
+        coordinates, country_code = result
+        if coordinates is not None:
+            item['coordinates'] = list(coordinates)
+            item['location'] = point(*coordinates)
+
+        phone = item.get('phone_number')
+        if phone:
+            item['phone_number'] = self.phones.normalize(phone, country_code)
+        return item
+
+
+class MongoWriter(threading.Thread):
+    """
+    Thread writing buffered profile upserts to MongoDB, so the reactor never waits for them.
+
+    Entries are taken from the bounded queue, when it's full ``HouzzPipeline`` holds new items back
+    instead of growing the memory.
+    """
+
+    def __init__(self, pipeline, queue_size, buffer_size, flush_interval):
+        super().__init__(name='mongo-writer', daemon=True)
+        self.pipeline = pipeline
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = []
+            deadline = None
+            while len(batch) < self.buffer_size:
+                timeout = None if deadline is None else max(deadline - time.time(), 0)
+                try:
+                    entry = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopped = True
+                    break
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+                batch.append(entry)
+            if batch:
+                failed, spent = self.pipeline.write([operation for operation, _, _ in batch])
+                reactor.callFromThread(self.pipeline.written, batch, failed, spent, self.queue.qsize())
+
+    def stop(self):
+        """
+        Write everything left in the queue and wait for the thread to finish
+        """
+        self.queue.put(None)
+        self.join()
 
 
 class HouzzPipeline(object):
+    """
+    Upsert profiles into MongoDB.
+
+    Upserts are buffered and sent by one ``bulk_write`` when ``MONGO_BUFFER_SIZE`` items are collected
+    or the oldest of them waits longer than ``MONGO_FLUSH_INTERVAL`` seconds.
+
+    With ``MONGO_WRITER = 'thread'`` the writes are made by ``MongoWriter`` and every item is finished
+    when it's saved. So are items of the spider with ``wait_saved`` attribute, i.e. ``APISpider`` checkpoints
+    its page after all profiles of the page are in MongoDB. The item which isn't saved is dropped
+    with ``ItemNotSaved``.
+    """
     profile_collection_name = 'profiles'
     logs_collection_name = 'logs'
+    client_class = pymongo.MongoClient
 
-    def __init__(self, mongo_uri, mongo_db):
+    def __init__(self, mongo_uri, mongo_db, buffer_size=500, flush_interval=5, writer='sync', queue_size=5000,
+                 index_background=True):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.writer_mode = writer
+        self.queue_size = queue_size
+        self.index_background = index_background
+        self.fingerprints = None
         self.client = None
         self.db = None
         self.profile_collection = None
         self.logs_collection = None
+        self.spider = None
+
+        self.buffer = []  # entries of (upsert operation, item, deferred)
+        self.buffer_started = None
+        self.flush_task = None
+        self.writer = None
 
     @classmethod
     def from_crawler(cls, crawler: scrapy.crawler.Crawler):
-        return cls(
+        pipeline = cls(
             mongo_uri=crawler.settings.get('MONGO_URI'),
-            mongo_db=crawler.settings.get('MONGO_DB')
+            mongo_db=crawler.settings.get('MONGO_DB'),
+            buffer_size=crawler.settings.getint('MONGO_BUFFER_SIZE', 500),
+            flush_interval=crawler.settings.getfloat('MONGO_FLUSH_INTERVAL', 5),
+            writer=crawler.settings.get('MONGO_WRITER', 'sync'),
+            queue_size=crawler.settings.getint('MONGO_QUEUE_SIZE', 5000),
+            index_background=crawler.settings.getbool('MONGO_INDEX_BACKGROUND', True)
         )
+        if crawler.settings.getbool('INCREMENTAL'):
+            pipeline.fingerprints = FingerprintStore.from_crawler(crawler)
+        return pipeline
 
     def open_spider(self, spider):
-        self.client: pymongo.MongoClient = pymongo.MongoClient(self.mongo_uri)
+        self.spider = spider
+        self.client: pymongo.MongoClient = self.client_class(self.mongo_uri)
         self.db: Database = self.client[self.mongo_db]
         self.profile_collection: Collection = self.db[self.profile_collection_name]
         self.logs_collection: Collection = self.db[self.logs_collection_name]
 
+        if self.index_background:
+            d = threads.deferToThread(self.ensure_indexes, True)
+            d.addErrback(lambda f: spider.logger.error(f'Indexes weren\'t created: {f.value}'))
+        else:
+            self.ensure_indexes(False)
+
+        if self.writer_mode == 'thread':
+            self.writer = MongoWriter(self, self.queue_size, self.buffer_size, self.flush_interval)
+            self.writer.start()
+        else:
+            self.flush_task = task.LoopingCall(self._flush_expired)
+            self.flush_task.start(min(self.flush_interval, 0.5), now=False)
+
     def close_spider(self, spider: APISpider):
+        if self.writer is not None:
+            d = threads.deferToThread(self.writer.stop)
+            d.addCallback(lambda _: threads.deferToThread(self._close, spider))
+            return d
+
+        if self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+        self._close(spider)
+
+    def ensure_indexes(self, background):
+        """
+        Create indexes used by the upserts, the log lookups and the geo queries if they don't exist yet.
+        Documents saved before ``user_name`` had been introduced are left out of the unique index
+
+        :param background: build indexes without locking the collections
+        """
+        self.profile_collection.create_index('user_name', unique=True, background=background,
+                                             partialFilterExpression={'user_name': {'$exists': True}})
+        self.profile_collection.create_index([('location', pymongo.GEOSPHERE)], background=background)
+        self.logs_collection.create_index('process_hash', unique=True, background=background,
+                                          partialFilterExpression={'process_hash': {'$type': 'string'}})
+
+    def _close(self, spider: APISpider):
+        """
+        Save the log of the process and close the connection
+        """
         stats = spider.stats
         finish_time = datetime.datetime.utcnow()
+        process_hash = getattr(spider, 'process_hash', None)
 
-        mongo_log = self.logs_collection.find_one({'process_hash': spider.process_hash})
-        spider.logger.debug(f"MONGO LOG: {mongo_log}")
-        if mongo_log is None:
-            log = {
-                'process_hash': spider.process_hash,
-                'start_datetime': stats.get_value('start_time'),
+        # several workers can write the same log at once, so it's merged only by atomic operators
+        update = {
+            '$min': {'start_datetime': stats.get_value('start_time')},
+            '$max': {
                 'finish_datetime': finish_time,
                 'total_spent_time': (finish_time - stats.get_value('start_time')).total_seconds(),
-                'profiles_added': stats.get_value('profiles_added'),
-                'profiles_total': stats.get_value('profiles_total'),
-                'error_count': 0 if stats.get_value('log_count/ERROR') is None else stats.get_value('log_count/ERROR'),
-                'retries_count': stats.get_value('retry_times', 0),
-            }
-            self.logs_collection.insert_one(log)
-        else:
-            if stats.get_value('log_count/ERROR') is None:
-                err_count = 0
-            else:
-                err_count = stats.get_value('log_count/ERROR')
-            log = {
-                'finish_datetime': finish_time,
-                'total_spent_time': (finish_time - stats.get_value('start_time')).total_seconds(),
-                'profiles_added': mongo_log['profiles_added'] + stats.get_value('profiles_added'),
-                'error_count': mongo_log['error_count'] + err_count,
-                'retries_count': mongo_log['error_count'] + stats.get_value('retry_times', 0),
-            }
-            self.logs_collection.update_one({'process_hash': spider.process_hash}, {'$set': log})
+                'profiles_total': stats.get_value('profiles_total', 0),
+            },
+            '$inc': {
+                'profiles_added': stats.get_value('profiles_added', 0),
+                'error_count': stats.get_value('log_count/ERROR', 0),
+                'retries_count': stats.get_value('retry/count', 0),
+                'workers_count': 1,
+                'duplicates_count': (stats.get_value('dedupe/local_skipped', 0)
+                                     + stats.get_value('dedupe/shared_skipped', 0)),
+            },
+        }
+        timings = TIMINGS.snapshot()
+        if timings:
+            update['$push'] = {'timings': timings}  # one entry per worker
+        self.logs_collection.update_one({'process_hash': process_hash}, update, upsert=True)
 
         self.client.close()
 
+    @timed('process_item')
     def process_item(self, item, spider: ProfilesSpider):
-        self.profile_collection.update({'contact_name': item['contact_name']}, dict(item), True)
-        spider.stats.set_value('profiles_added', spider.stats.get_value('profiles_added', 0) + 1)
-        spider.logger.info(f'Profile item "{item["contact_name"]}" processed')
-        return item
+        if not item.get('user_name'):
+            # the upsert filter ``{'user_name': None}`` matches every document without the user name
+            spider.stats.inc_value('profiles_without_user_name')
+            raise DropItem('Profile without the user name isn\'t saved')
+
+        if self.fingerprints is not None:
+            if self.fingerprints.is_unchanged(item['user_name'], item.get('fingerprint')):
+                spider.stats.inc_value('profiles_unchanged')
+                return item
+
+        operation = UpdateOne({'user_name': item['user_name']}, {'$set': as_dict(item)}, upsert=True)
+        if self.writer is not None:
+            d = defer.Deferred()
+            self._enqueue((operation, item, d))
+            return d
+
+        # held items keep their responses in memory, so they are held only if the spider waits for them
+        d = defer.Deferred() if getattr(spider, 'wait_saved', False) else None
+        if not self.buffer:
+            self.buffer_started = time.time()
+        self.buffer.append((operation, item, d))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return d if d is not None else item
+
+    def _enqueue(self, entry):
+        """
+        Pass the entry to the writer thread. When its queue is full try again a bit later,
+        so the item isn't finished and Scrapy slows down
+        """
+        try:
+            self.writer.queue.put_nowait(entry)
+        except queue.Full:
+            self.spider.stats.inc_value('mongo/queue_full')
+            reactor.callLater(0.05, self._enqueue, entry)
+            return
+        self.spider.stats.max_value('mongo/max_queue_depth', self.writer.queue.qsize())
+
+    def flush(self):
+        """
+        Send buffered upserts to MongoDB in one unordered bulk write
+        """
+        if not self.buffer:
+            return
+        batch = self.buffer
+        self.buffer = []
+        self.buffer_started = None
+        failed, spent = self.write([operation for operation, _, _ in batch])
+        self.written(batch, failed, spent, 0)
+
+    def write(self, operations):
+        """
+        Make the bulk write. It's safe to call it from any thread, it never raises,
+        so neither the writer thread nor the flush task dies when MongoDB is unreachable
+
+        :return: indexes of failed operations with their error messages, seconds spent
+        """
+        started = time.time()
+        failed = {}
+        try:
+            self.profile_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                failed[error['index']] = error['errmsg']
+        except PyMongoError as e:
+            # lost connection or no server selected in time, none of the upserts is known to be saved
+            failed = dict.fromkeys(range(len(operations)), f'{type(e).__name__}: {e}')
+        return failed, time.time() - started
+
+    def written(self, batch, failed, spent, queue_depth):
+        """
+        Report the result of the bulk write per profile and finish the waiting items
+        """
+        stats = self.spider.stats
+        for i, (_, item, d) in enumerate(batch):
+            if i in failed:
+                self.spider.logger.error(f'Profile item "{item["user_name"]}" wasn\'t saved: {failed[i]}')
+                if d is not None:
+                    d.errback(Failure(ItemNotSaved(f'Profile "{item["user_name"]}" wasn\'t saved')))
+            else:
+                if self.fingerprints is not None and item.get('fingerprint') is not None:
+                    # only the saved fingerprint makes later copies of the profile unchanged
+                    self.fingerprints.update(item['user_name'], item['fingerprint'])
+                if d is not None:
+                    d.callback(item)
+
+        stats.inc_value('profiles_failed', len(failed))
+        stats.inc_value('profiles_added', len(batch) - len(failed))
+        stats.inc_value('mongo/writes')
+        stats.inc_value('mongo/write_time_ms', int(spent * 1000))
+        stats.max_value('mongo/write_max_time_ms', int(spent * 1000))
+        stats.set_value('mongo/queue_depth', queue_depth)
+        self.spider.logger.info(f'{len(batch) - len(failed)} profile items processed')
+
+    def _flush_expired(self):
+        """
+        Flush the buffer if its oldest item waits too long or nothing is being downloaded.
+        In the latter case no new items are coming soon, and the buffered ones keep their pages unfinished
+        """
+        if self.buffer_started is None:
+            return
+        engine = self.spider.crawler.engine
+        if time.time() - self.buffer_started >= self.flush_interval or not engine.downloader.active:
+            self.flush()
+
+
+class ExportPipeline(object):
+    """
+    Stream profiles into compressed files instead of MongoDB, for bulk loads into analytics.
+
+    Items are written by batches of ``EXPORT_BATCH_SIZE`` rows, so the memory doesn't grow with the crawl.
+    The shard is closed and a new one is started when it exceeds ``EXPORT_ROTATE_BYTES``.
+    Every worker writes its own shards named ``<process_hash>-<pid>-<token>-<number>``, and every closed shard
+    is appended to ``manifest.jsonl`` of the export directory, which is shared by all workers.
+
+    Items of the spider with ``wait_saved`` attribute are finished when their rows are written, as ``HouzzPipeline``
+    does, and the buffer is written at least every ``EXPORT_FLUSH_INTERVAL`` seconds. Rows of the Parquet shard
+    are readable only after the shard is closed.
+    """
+    manifest_name = 'manifest.jsonl'
+
+    def __init__(self, directory, export_format='jsonl', batch_size=1000, rotate_bytes=128 * 1024 * 1024,
+                 flush_interval=5):
+        if export_format not in exporters.SHARD_CLASSES:
+            raise NotConfigured(f'Unknown EXPORT_FORMAT "{export_format}"')
+        if export_format == 'parquet' and exporters.pyarrow is None:
+            raise NotConfigured('pyarrow is required by EXPORT_FORMAT = "parquet"')
+        self.directory = directory
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.rotate_bytes = rotate_bytes
+        self.flush_interval = flush_interval
+        self.spider = None
+        self.prefix = None
+        self.shard = None
+        self.shard_number = 0
+        self.shard_rows = 0
+        self.rows = []
+        self.waiting = []  # items of the buffered rows and their deferreds fired when the rows are written
+        self.buffer_started = None
+        self.flush_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler: scrapy.crawler.Crawler):
+        return cls(
+            directory=crawler.settings.get('EXPORT_DIR', 'exports'),
+            export_format=crawler.settings.get('EXPORT_FORMAT', 'jsonl'),
+            batch_size=crawler.settings.getint('EXPORT_BATCH_SIZE', 1000),
+            rotate_bytes=crawler.settings.getint('EXPORT_ROTATE_BYTES', 128 * 1024 * 1024),
+            flush_interval=crawler.settings.getfloat('EXPORT_FLUSH_INTERVAL', 5)
+        )
+
+    def open_spider(self, spider):
+        self.spider = spider
+        os.makedirs(self.directory, exist_ok=True)
+        # the random token keeps shards of a later run apart even if it gets the same pid
+        self.prefix = f'{getattr(spider, "process_hash", None) or "local"}-{os.getpid()}-{os.urandom(4).hex()}'
+        if getattr(spider, 'wait_saved', False):
+            self.flush_task = task.LoopingCall(self._flush_expired)
+            self.flush_task.start(min(self.flush_interval, 0.5), now=False)
+
+    def close_spider(self, spider):
+        if self.flush_task is not None and self.flush_task.running:
+            self.flush_task.stop()
+        self.flush()
+        self._close_shard()
+
+    @timed('export_item')
+    def process_item(self, item, spider):
+        if not self.rows:
+            self.buffer_started = time.time()
+        self.rows.append(as_dict(item))
+        # held items keep their responses in memory, so they are held only if the spider waits for them
+        d = defer.Deferred() if self.flush_task is not None else None
+        if d is not None:
+            self.waiting.append((item, d))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return d if d is not None else item
+
+    def flush(self):
+        """
+        Write buffered rows into the current shard and rotate it if it's big enough.
+        It never raises, the items whose rows failed to be written are dropped with ``ItemNotSaved``
+        """
+        if not self.rows:
+            return
+        rows, waiting = self.rows, self.waiting
+        self.rows, self.waiting, self.buffer_started = [], [], None
+        try:
+            if self.shard is None:
+                self.shard_number += 1
+                shard_class = exporters.SHARD_CLASSES[self.export_format]
+                path = os.path.join(self.directory, f'{self.prefix}-{self.shard_number:04d}.{shard_class.extension}')
+                self.shard = shard_class(path)
+            self.shard.write_rows(rows)
+        except Exception as e:
+            self.spider.logger.error(f'{len(rows)} profiles weren\'t exported: {e!r}')
+            self.spider.stats.inc_value('export/failed_rows', len(rows))
+            for item, d in waiting:
+                d.errback(Failure(ItemNotSaved(f'Profile "{item.get("user_name")}" wasn\'t exported')))
+            return
+
+        self.shard_rows += len(rows)
+        self.spider.stats.inc_value('export/rows', len(rows))
+        for item, d in waiting:
+            d.callback(item)
+        if self.shard.size >= self.rotate_bytes:
+            self._close_shard()
+
+    def _flush_expired(self):
+        """
+        Flush the buffer if its oldest row waits too long or nothing is being downloaded,
+        so the pages of the buffered items are finished
+        """
+        if self.buffer_started is None:
+            return
+        engine = self.spider.crawler.engine
+        if time.time() - self.buffer_started >= self.flush_interval or not engine.downloader.active:
+            self.flush()
+
+    def _close_shard(self):
+        """
+        Close the current shard and add it to the manifest
+        """
+        if self.shard is None:
+            return
+        self.shard.close()
+        entry = {
+            'path': os.path.basename(self.shard.path),
+            'format': self.export_format,
+            'rows': self.shard_rows,
+            'bytes': os.path.getsize(self.shard.path),
+            'process_hash': getattr(self.spider, 'process_hash', None),
+            'pid': os.getpid(),
+            'closed': datetime.datetime.utcnow().isoformat(),
+        }
+        # a single write with O_APPEND isn't interleaved with lines of other workers
+        fd = os.open(os.path.join(self.directory, self.manifest_name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(entry) + '\n').encode('utf-8'))
+        finally:
+            os.close(fd)
+        self.spider.stats.inc_value('export/shards')
+        self.spider.logger.info(f'Export shard {entry["path"]} closed with {self.shard_rows} rows')
+        self.shard = None
+        self.shard_rows = 0
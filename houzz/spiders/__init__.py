@@ -3,104 +3,187 @@
 # Please refer to the documentation for information on how to create and manage
 # your spiders.
 import json
+from collections import deque
 
-import phonenumbers
 import scrapy
 from urllib.parse import urlencode
-from geopy import Nominatim
-from geopy.exc import GeocoderTimedOut
-from phonenumbers import NumberParseException
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.loader import ItemLoader
 from scrapy.statscollectors import MemoryStatsCollector
+from twisted.internet import task, threads
 
-from houzz.items import Profile, Address, ProfileLoader, format_phone
+from houzz.checkpoints import checkpoint_store
+from houzz.extractors import ProfilePageExtractor
+from houzz.fingerprints import FingerprintStore, fingerprint
+from houzz.items import Profile, Address, ProfileLoader, ItemNotSaved, as_dict, user_name_from_url, profile_from_api
 from houzz.settings import PROXY_ADDR
+from houzz.timing import timed
+from houzz.workqueue import WorkQueue, node_id
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class GeoLocator:
-    def __init__(self):
-        self.geo_coder = None
-        self.timeout = 5
 
-    def geolocate(self, query: str, default_code: str= 'JP'):
-        """
-        Processor to transform postal into coordinates on the Globe.
-
-        *NOTE*: Be careful because the function is depending on chosen geo driver very much.
-        Now it is set for use with Open Streets Map ``Nominatim`` driver
-
-        :param query: postal code
-        :param default_code: default country code to use
-        :return: geo longitude, geo.latitude, country_code
-        """
-        if not self.geo_coder:
-            self.geo_coder = Nominatim(country_bias=default_code)
-        try:
-            geo = self.geo_coder.geocode(query, addressdetails=True, timeout=self.timeout)
-        except GeocoderTimedOut:
-            return None, default_code
-        except Exception:
-            return None, default_code
-        if not geo:
-            return None, default_code
-        return (geo.longitude, geo.latitude), geo.raw['address']['country_code']
+def loads_json(body: bytes):
+    """
+    Decode JSON straight from the bytes of the response, by ``orjson`` if it's installed
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
 
 
-class ProfilesSpider(scrapy.Spider, GeoLocator):
+class ProfilesSpider(scrapy.Spider):
     name = 'profiles'
     start_urls = [
         'https://www.houzz.jp/professionals'
     ]
 
+    geo_bias = 'JP'  # country code used by ``GeoPipeline`` when the postal isn't found
+
     def __init__(self, stats: MemoryStatsCollector, name=None, **kwargs):
         super().__init__(name=name, **kwargs)
-        GeoLocator.__init__(self)
         self.extracted = 0
         self.stats = stats
-        self.geo_coder = None  # realized lazy connection to geo coder
+        self.fingerprints = None  # store of known fingerprints in the incremental mode
+        self.extractor = ProfilePageExtractor()
+        self.stashed_listings = []  # next listing pages held back while the scheduler is full
 
     def start_requests(self):
         for url in self.start_urls:
-            yield scrapy.Request(url=url, callback=self.parse, meta={'proxy': PROXY_ADDR})
+            yield scrapy.Request(url=url, callback=self.parse, meta={'proxy': PROXY_ADDR},
+                                 priority=self.settings.getint('FRONTIER_LISTING_PRIORITY', -10))
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = cls(crawler.stats, *args, **kwargs)
         spider._set_crawler(crawler)
+        crawler.signals.connect(spider.resume_listing, signal=signals.response_received)
+        crawler.signals.connect(spider.resume_listing_idle, signal=signals.spider_idle)
+        if crawler.settings.getbool('INCREMENTAL'):
+            spider.fingerprints = FingerprintStore.from_crawler(crawler)
         return spider
 
+    @timed('parse')
     def parse(self, response: scrapy.http.TextResponse):
         """
-        The function parses recursively the list of professionals while amount of extracted profiles wasn't exceed
-        MAX_COUNT value.
+        The function parses the list of professionals page by page while amount of extracted profiles wasn't exceed
+        MAX_COUNT value. Only the next page is followed, so listing pages come as one ordered stream.
+        If the page has no button marked as next all navigation buttons are followed, the visited pages
+        are dropped by the duplicates filter. Listing pages have lower priority than profiles, and they are
+        held back while the scheduler has more than ``FRONTIER_HIGH_WATER`` requests
         """
         if not self.stats.get_value('profiles_total', None):
             total = int(''.join(response.css(".main-title::text").re(r"\d+")))
             self.stats.set_value('profiles_total', total)
-        for href in response.css('a.pro-title::attr(href)'):
+        # plain strings in meta let requests be saved into the disk queue of ``JOBDIR``
+        for href in response.css('a.pro-title::attr(href)').extract():
             if self.extracted >= self.settings.get('MAX_COUNT'):
                 return
             self.extracted += 1
             yield response.follow(href, callback=self.parse_profile, meta={'url': href, 'proxy': PROXY_ADDR})
 
-        for href in response.css('a.navigation-button'):
-            yield response.follow(href, callback=self.parse, meta={'proxy': PROXY_ADDR})
+        hrefs = (response.css('a.navigation-button.next::attr(href)').extract()
+                 or response.css('a.navigation-button::attr(href)').extract())
+        requests = [response.follow(href, callback=self.parse, meta={'proxy': PROXY_ADDR},
+                                    priority=self.settings.getint('FRONTIER_LISTING_PRIORITY', -10))
+                    for href in hrefs]
+        if requests and self.pending_requests() >= self.settings.getint('FRONTIER_HIGH_WATER', 1000):
+            self.stashed_listings.extend(requests)
+            self.stats.inc_value('frontier/stashed')
+            return
+        yield from requests
+
+    def pending_requests(self) -> int:
+        """
+        Amount of requests waiting in the scheduler
+        """
+        slot = self.crawler.engine.slot
+        return len(slot.scheduler) if slot is not None else 0
 
+    def resume_listing(self, response=None, request=None, spider=None):
+        """
+        Schedule the held back listing pages when the scheduler is drained below ``FRONTIER_LOW_WATER``
+        """
+        if spider is not self or not self.stashed_listings:
+            return False
+        if self.pending_requests() > self.settings.getint('FRONTIER_LOW_WATER', 500):
+            return False
+        requests, self.stashed_listings = self.stashed_listings, []
+        for request in requests:
+            self.crawler.engine.crawl(request, self)
+        return True
+
+    def resume_listing_idle(self, spider):
+        if self.resume_listing(spider=spider):
+            raise DontCloseSpider
+
+    @timed('parse_profile')
     def parse_profile(self, response: scrapy.http.TextResponse):
         """
-        Parses the profile of each professional and redirect to professional projects page to grab their amount
+        Parses the profile of each professional. The amount of projects is taken from the sidebar of the profile,
+        if it isn't there (or ``PROJECTS_COUNT_MODE`` is 'follow') the projects page is requested to grab it.
+        Coordinates and phone format are resolved later by ``GeoPipeline``
 
+        """
+        # the profile may be redirected to the url without the user name, then it's taken from the followed link
+        user_name = user_name_from_url(response.url) or user_name_from_url(response.meta.get('url', ''))
+        if user_name is None:
+            # profiles are upserted by the user name, without it the profile would overwrite another one
+            self.stats.inc_value('profiles_without_user_name')
+            self.logger.warning(f'Profile {response.url} is skipped, its user name isn\'t known')
+            return
+
+        if self.settings.getbool('PROFILE_FAST_PATH'):
+            root = response.selector.root
+            item = self.extractor.extract(root)
+            item['user_name'] = user_name
+            item['profile_url'] = response.url
+            projects_count, projects_url = self.extractor.projects(root)
+        else:
+            item = self.load_profile(response, user_name)
+            projects_tab = response.css("a.sidebar-item-label[compid=projects_tab]")[0]
+            projects_count = projects_tab.css("::text").re_first(r'\d+')
+            projects_url = projects_tab.css("::attr(href)")[0]
+
+        inline = self.settings.get('PROJECTS_COUNT_MODE', 'inline') == 'inline'
+        if inline and projects_count is not None:
+            item['projects_done_count'] = int(projects_count)
+
+        if self.fingerprints is not None:
+            # the projects count is a part of the fingerprint only if it's known before the projects page
+            fp = fingerprint(as_dict(item))
+            if self.fingerprints.is_unchanged(item.get('user_name'), fp):
+                self.stats.inc_value('profiles_unchanged')
+                return
+            item['fingerprint'] = fp
+
+        if 'projects_done_count' in item:
+            yield item
+            return
+        if inline:
+            self.stats.inc_value('projects_count_requests')
+
+        # only the loaded fields are passed, so the profile response is released before the projects one comes
+        yield response.follow(projects_url, callback=self.parse_projects_count,
+                              meta={'profile': as_dict(item), 'proxy': PROXY_ADDR})
+
+    def load_profile(self, response: scrapy.http.TextResponse, user_name):
+        """
+        Load the profile from the page by item loaders
         """
         postal = response.css(".pro-info-horizontal-list .info-list-text [itemprop=postalCode]::text").extract_first()
-        coordinates, country_code = self.geolocate(postal)
 
         l = ProfileLoader(item=Profile(), response=response)
+        l.add_value('user_name', user_name)
         l.add_value('contact_name',
                     response.css(".pro-info-horizontal-list .info-list-text")[1].css(":not(b)::text").re(r'[\w ]+'))
         l.add_css('activity_area', ".pro-info-horizontal-list .info-list-text [itemprop=child] [itemprop=title]::text")
 
-        unformatted_phone = response.css(".pro-contact-methods .pro-contact-text::text").extract_first()
-        l.add_value('phone_number', format_phone(unformatted_phone, country_code))
+        l.add_css('phone_number', ".pro-contact-methods .pro-contact-text::text")
 
         l.add_css('website', ".pro-contact-methods .proWebsiteLink::attr(href)")
 
@@ -113,7 +196,7 @@ class ProfilesSpider(scrapy.Spider, GeoLocator):
         address = al.load_item()
         l.add_value('address', dict(address))
 
-        l.add_value('coordinates', coordinates)
+        l.add_value('geo_query', postal)
 
         l.add_css('company_name', "a.profile-full-name::text")
 
@@ -127,23 +210,21 @@ class ProfilesSpider(scrapy.Spider, GeoLocator):
         l.add_css('pro_rating', ".profile-title .pro-rating [itemprop=ratingValue]::attr(content)")
         l.add_css('reviews_count', ".profile-title .pro-rating [itemprop=reviewCount]::text")
 
-        projects_url = response.css("a.sidebar-item-label[compid=projects_tab]::attr(href)")[0]
-
-        yield response.follow(projects_url, callback=self.parse_projects_count, meta={'profile_loader': l,
-                                                                                      'proxy': PROXY_ADDR})
+        return l.load_item()
 
+    @timed('parse_projects_count')
     def parse_projects_count(self, response: scrapy.http.TextResponse):
-        profile_loader: ProfileLoader = response.meta['profile_loader']
-        try:
-            profile_loader.add_value('projects_done_count', response.css("#projectsBody .header-1::text").re(r'\d+'))
-        except IndexError:
-            pass
-        yield profile_loader.load_item()
+        item = response.meta['profile']
+        count = response.css("#projectsBody .header-1::text").re(r'\d+')
+        if count:
+            item['projects_done_count'] = int(count[0])
+        yield item
 
 
-class APISpider(scrapy.Spider, GeoLocator):
+class APISpider(scrapy.Spider):
     name = 'api'
     url = 'https://api.houzz.com/api?'
+    wait_saved = True  # pages are checkpointed when their items are saved, see ``HouzzPipeline``
 
     headers = {
         'X-HOUZZ-API-SITE-ID': 106,  # ID of site ot extract data from
@@ -155,90 +236,372 @@ class APISpider(scrapy.Spider, GeoLocator):
         'Connection': 'Keep-Alive'
     }
 
-    def __init__(self, stats: MemoryStatsCollector, name=None, process_hash=None, start_from=None, max_count=None, **kwargs):
+    def __init__(self, stats: MemoryStatsCollector, name=None, process_hash=None, start_from=None, max_count=None,
+                 distributed=False, work=None, **kwargs):
         super().__init__(name=name, **kwargs)
-        GeoLocator.__init__(self)
         self.extracted = 0
         self.stats = stats
-        self.geo_coder = None  # realized lazy connection to geo coder
 
-        self.last_item = int(start_from) if start_from is not None else start_from
+        self.start_from = int(start_from) if start_from is not None else start_from
         self.process_hash = process_hash
         self.max_count = int(max_count) if max_count is not None else max_count
+        self.offsets = deque()  # (offset, end, unit id) of pages which aren't requested yet
+        self.pages = {}  # offset of the parsed page -> its items which aren't finished by the pipelines yet
+        self.checkpoints = None
+        self.fingerprints = None  # store of known fingerprints in the incremental mode
+
+        # in the distributed mode pages are taken from the units leased from the shared work queue,
+        # or from ``LocalWorkQueue`` passed by ``python -m houzz``
+        self.distributed = bool(distributed) and distributed != '0'
+        self.work = work
+        self.owner = None
+        self.units = {}  # leased unit id -> amount of its pages which aren't parsed yet
+        self.failed_units = set()  # leased units with failed pages
+        self.renew_task = None
+        self.done = set()  # offsets of pages done according to the checkpoints
+        self.leasing = False  # the next unit is being leased by a thread
+        self.work_drained = False  # the work queue has no free units
+        self.free_slots = 0  # pages in flight waiting for the next unit to be leased
 
     def start_requests(self):
-        if self.last_item is None:
-            self.last_item = self.settings.get('START_FROM')
+        """
+        Request the first ``API_PAGES_IN_FLIGHT`` pages, every parsed page requests the next one.
+        So the amount of pages in flight stays the same and they are requested in order
+        """
+        if self.start_from is None:
+            self.start_from = self.settings.getint('START_FROM')
         if self.max_count is None:
-            self.max_count = self.settings.get('MAX_COUNT')
-
-        while self.last_item < self.max_count:
-            body = {
-                'version': 174,
-                'method': 'getProfessionals',
-                'format': 'json',
-                'dateFormat': 'sec',
-                'start': self.last_item,
-                'numberOfItems': self.settings.get('ITEMS_ON_PAGE'),
-                'includeSponsored': 'yes'
-            }
-            url = self.url + urlencode(body)
-            yield scrapy.Request(url=url, callback=self.parse, meta={'proxy': PROXY_ADDR}, headers=self.headers)
+            self.max_count = self.settings.getint('MAX_COUNT')
+
+        done = set()
+        if self.process_hash is not None and self.settings.getbool('CHECKPOINT_ENABLED', True):
+            self.checkpoints = checkpoint_store(self.settings, self.process_hash)
+            done = self.checkpoints.load()
+
+        if self.distributed:
+            if self.process_hash is None:
+                raise ValueError('Distributed crawl needs process_hash argument')
+            if self.work is None:
+                self.work = WorkQueue.from_settings(self.settings, self.process_hash)
+            self.owner = node_id()
+            self.done = done
+            self.renew_task = task.LoopingCall(self.renew_leases)
+            self.renew_task.start(self.work.lease_time / 3, now=False)
+            # pages are requested when the first unit is leased
+            self.free_slots = self.settings.getint('API_PAGES_IN_FLIGHT', 4)
+            self.lease_unit()
+            return
+        offsets = range(self.start_from, self.max_count, self.settings.getint('ITEMS_ON_PAGE'))
+        self.stats.set_value('checkpoint/skipped_pages', len(done.intersection(offsets)))
+        self.offsets.extend((offset, self.max_count, None) for offset in offsets if offset not in done)
+
+        for _ in range(self.settings.getint('API_PAGES_IN_FLIGHT', 4)):
+            request = self.next_page()
+            if request is None:
+                return
+            yield request
+
+    def lease_unit(self):
+        """
+        Lease the next unit from the work queue by a thread, so the reactor isn't blocked by MongoDB.
+        Pages of the unit are requested by ``unit_leased`` into the free slots
+        """
+        if self.leasing or self.work_drained:
+            return
+        self.leasing = True
+        d = threads.deferToThread(self.work.lease, self.owner)
+        d.addCallbacks(self.unit_leased, self.lease_failed)
+
+    def unit_leased(self, unit):
+        self.leasing = False
+        if unit is None:
+            self.work_drained = True  # no free units, the spider is closed when its pages are finished
+            return
+        self.stats.inc_value('work/leased_units')
+        pages = range(unit['start'], unit['end'], self.settings.getint('ITEMS_ON_PAGE'))
+        offsets = [offset for offset in pages if offset not in self.done]
+        self.stats.inc_value('checkpoint/skipped_pages', len(pages) - len(offsets))
+        self.units[unit['_id']] = len(offsets)
+        self.offsets.extend((offset, unit['end'], unit['_id']) for offset in offsets)
+        if not offsets:
+            self.unit_page_done(unit['_id'], True, count=0)
+
+        while self.free_slots > 0:
+            request = self.page_request()
+            if request is None:
+                self.lease_unit()  # all pages of the unit are requested, the rest of the slots wait for the next one
+                return
+            self.free_slots -= 1
+            self.crawler.engine.crawl(request, self)
+
+    def lease_failed(self, failure):
+        """
+        Stop leasing when the work queue fails. The units which aren't leased are taken by the next workers
+        """
+        self.leasing = False
+        self.work_drained = True
+        self.stats.inc_value('work/lease_errors')
+        self.logger.error(f'Unit wasn\'t leased: {failure.value!r}')
+
+    def keep_leasing(self, spider):
+        """
+        Don't close the spider while the unit is being leased, its pages aren't requested yet
+        """
+        if spider is self and self.leasing:
+            raise DontCloseSpider
+
+    def next_page(self):
+        """
+        Create request of the next page or return None if all pages are requested. In the distributed mode
+        the next unit is leased when the pages run out, and its page takes the freed slot
+        """
+        request = self.page_request()
+        if request is None and self.work is not None and not self.work_drained:
+            self.free_slots += 1
+            self.lease_unit()
+        return request
+
+    def page_request(self):
+        """
+        Create request of the next page which isn't requested yet, None if there are no such pages
+        """
+        total = self.stats.get_value('profiles_total')
+        while True:
+            if not self.offsets:
+                return None
+            offset, end, unit_id = self.offsets.popleft()
+            if total is None or offset < total:
+                break
+            if unit_id is None:
+                return None
+            self.unit_page_done(unit_id, True)  # leased pages past the last profile are empty
+
+        body = {
+            'version': 174,
+            'method': 'getProfessionals',
+            'format': 'json',
+            'dateFormat': 'sec',
+            'start': offset,
+            'numberOfItems': min(self.settings.getint('ITEMS_ON_PAGE'), end - offset),
+            'includeSponsored': 'yes'
+        }
+        url = self.url + urlencode(body)
+        return scrapy.Request(url=url, callback=self.parse, errback=self.parse_failed,
+                              meta={'proxy': PROXY_ADDR, 'offset': offset, 'unit': unit_id}, headers=self.headers)
+
+    def unit_page_done(self, unit_id, success, count=1):
+        """
+        Count the finished page of the leased unit. When all pages of the unit are finished it's marked done
+        in the work queue, or given back to it if some page failed
+        """
+        if unit_id is None:
+            return
+        self.units[unit_id] -= count
+        if not success:
+            self.failed_units.add(unit_id)
+        if self.units[unit_id] > 0:
+            return
+        del self.units[unit_id]
+        if unit_id in self.failed_units:
+            self.failed_units.discard(unit_id)
+            self.stats.inc_value('work/released_units')
+            d = threads.deferToThread(self.work.release, unit_id, self.owner)
+        else:
+            self.stats.inc_value('work/done_units')
+            d = threads.deferToThread(self.work.complete, unit_id, self.owner)
+        d.addErrback(lambda f: self.logger.error(f'Unit {unit_id} wasn\'t updated: {f.value!r}'))
+
+    def renew_leases(self):
+        """
+        Extend leases of the units which are being crawled
+        """
+        def renew(unit_ids):
+            return [unit_id for unit_id in unit_ids if not self.work.renew(unit_id, self.owner)]
+
+        def lost(unit_ids):
+            for unit_id in unit_ids:
+                self.stats.inc_value('work/lost_leases')
+                self.logger.warning(f'Lease of unit {unit_id} is taken over by another node')
+
+        d = threads.deferToThread(renew, list(self.units))
+        d.addCallback(lost)
+        d.addErrback(lambda f: self.logger.error(f'Leases weren\'t renewed: {f.value!r}'))
+        return d
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = cls(crawler.stats, *args, **kwargs)
         spider._set_crawler(crawler)
+        crawler.signals.connect(spider.close_checkpoints, signal=signals.spider_closed)
+        crawler.signals.connect(spider.item_saved, signal=signals.item_scraped)
+        crawler.signals.connect(spider.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(spider.keep_leasing, signal=signals.spider_idle)
+        if crawler.settings.getbool('INCREMENTAL'):
+            spider.fingerprints = FingerprintStore.from_crawler(crawler)
         return spider
 
+    def close_checkpoints(self, spider):
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+        if self.work is not None:
+            if self.renew_task.running:
+                self.renew_task.stop()
+
+            def release(unit_ids):
+                for unit_id in unit_ids:  # the spider is stopped before the unit is finished
+                    self.work.release(unit_id, self.owner)
+                self.work.close()
+
+            # the closing of the spider waits for the returned deferred
+            d = threads.deferToThread(release, list(self.units))
+            d.addErrback(lambda f: self.logger.error(f'Units weren\'t released: {f.value!r}'))
+            return d
+
+    @property
+    def geo_bias(self):
+        return self.settings.get('GEO_BIAS')
+
+    @timed('parse')
     def parse(self, response: scrapy.http.TextResponse):
-        if self.last_item >= self.max_count:
-            return  # we exceed max amount of profiles, should exit
-        data = json.loads(response.body_as_unicode())
-        if data['Ack'] != 'Success':
-            return  # something wrong happened, should exit
+        offset = response.meta['offset']
+        page = {'pending': 0, 'failed': False, 'parsed': False, 'unit': response.meta.get('unit')}
+        self.pages[offset] = page
+        success = False
+        # the broken page must not stop the crawl, the next page is requested whatever happens
+        try:
+            if self.settings.getbool('API_FAST_PATH'):
+                data = loads_json(response.body)
+            else:
+                data = json.loads(response.body_as_unicode())
+            if data['Ack'] == 'Success':
+                for item in self.parse_page(data, response):
+                    page['pending'] += 1
+                    yield item
+                success = True
+            else:
+                self.logger.error(f'Page {offset} failed: {data["Ack"]}')
+        except Exception as e:
+            self.stats.inc_value('api/broken_pages')
+            self.logger.error(f'Page {offset} is broken: {e!r}')
+
+        if success:
+            page['parsed'] = True
+            self.finish_page(offset)
+        else:
+            del self.pages[offset]
+            self.unit_page_done(page['unit'], False)
+
+        request = self.next_page()
+        if request is not None:
+            yield request
+
+    def parse_failed(self, failure):
+        """
+        Log the failed page and keep on requesting the next ones
+        """
+        if failure.request.meta.get('retry_scheduled'):
+            return  # the retry of the page is held by ``BackoffRetryMiddleware``, it requests the next one
+        self.logger.error(f'Page failed: {failure.value!r}')
+        self.unit_page_done(failure.request.meta.get('unit'), False)
+        request = self.next_page()
+        if request is not None:
+            yield request
+
+    def item_saved(self, item, response, spider):
+        self.item_finished(response, spider, failed=False)
+
+    def item_dropped(self, item, response, exception, spider):
+        # duplicates are saved by another worker, only the items which failed to be saved fail the page
+        self.item_finished(response, spider, failed=isinstance(exception, ItemNotSaved))
+
+    def item_finished(self, response, spider, failed):
+        """
+        Count the item of the page finished by the pipelines
+        """
+        page = self.pages.get(response.meta.get('offset')) if spider is self else None
+        if page is None:
+            return
+        page['pending'] -= 1
+        page['failed'] = page['failed'] or failed
+        self.finish_page(response.meta['offset'])
+
+    def finish_page(self, offset):
+        """
+        Checkpoint the page when it's parsed and all its items are saved. So the page is crawled again
+        after the crash if some of its items were still in the pipelines
+        """
+        page = self.pages[offset]
+        if not page['parsed'] or page['pending'] > 0:
+            return
+        del self.pages[offset]
+        if page['failed']:
+            self.logger.error(f'Page {offset} isn\'t checkpointed, some of its profiles weren\'t saved')
+        else:
+            self.page_done(offset)
+        self.unit_page_done(page['unit'], not page['failed'])
+
+    def page_done(self, offset):
+        """
+        Save the offset of successfully parsed page into the checkpoint store
+        """
+        if self.checkpoints is None:
+            return
+        d = threads.deferToThread(self.checkpoints.mark_done, offset)
+        d.addErrback(lambda f: self.logger.error(f'Checkpoint of page {offset} wasn\'t saved: {f.value!r}'))
 
+    def parse_page(self, data, response: scrapy.http.TextResponse):
+        """
+        Extract profiles from the decoded page of API
+        """
         if not self.stats.get_value('profiles_total', None):
             self.stats.set_value('profiles_total', int(data['TotalProfessionalCount']))
 
+        fast_path = self.settings.getbool('API_FAST_PATH')
         for prof in data['Professionals']:
-            prof_info = prof['Professional']
-
-            l = ProfileLoader(item=Profile(), response=response)
-            l.add_value('contact_name', prof['UserName'])
-            l.add_value('activity_area', self.get_item('ServicesProvided', prof_info))
-            l.add_value('website', self.get_item('WebSite', prof_info))
-            l.add_value('email', self.get_item('Email', prof_info))
-
-            al = ItemLoader(item=Address(), response=response)
-            al.add_value('postal', self.get_item('Zip', prof_info))
-            al.add_value('prefecture', self.get_item('State', prof_info))
-            al.add_value('street', self.get_item('Address', prof_info))
-            al.add_value('city', self.get_item('City', prof_info))
-
-            address = al.load_item()
-            l.add_value('address', dict(address))
-
-            coordinates, country_code = self.geolocate(prof_info['Location'],
-                                                       default_code=self.settings.get('GEO_BIAS'))
-            l.add_value('coordinates', coordinates)
-
-            if country_code is not None:
-                try:
-                    l.add_value('phone_number', format_phone(prof_info['Phone'], country_code))
-                except NumberParseException:
-                    l.add_value('phone_number', prof_info['Phone'])
-            else:
-                l.add_value('phone_number', prof_info['Phone'])
+            fp = None
+            if self.fingerprints is not None:
+                fp = fingerprint(prof)
+                if self.fingerprints.is_unchanged(prof['UserName'], fp):
+                    self.stats.inc_value('profiles_unchanged')
+                    continue
+
+            item = profile_from_api(prof) if fast_path else self.load_profile(prof, response)
+            if fp is not None:
+                item['fingerprint'] = fp
+            yield item
+
+    def load_profile(self, prof, response: scrapy.http.TextResponse):
+        """
+        Load the profile of one professional from API data by item loaders
+        """
+        prof_info = prof['Professional']
+
+        l = ProfileLoader(item=Profile(), response=response)
+        l.add_value('user_name', prof['UserName'])
+        l.add_value('contact_name', prof['UserName'])
+        l.add_value('activity_area', self.get_item('ServicesProvided', prof_info))
+        l.add_value('website', self.get_item('WebSite', prof_info))
+        l.add_value('email', self.get_item('Email', prof_info))
+
+        al = ItemLoader(item=Address(), response=response)
+        al.add_value('postal', self.get_item('Zip', prof_info))
+        al.add_value('prefecture', self.get_item('State', prof_info))
+        al.add_value('street', self.get_item('Address', prof_info))
+        al.add_value('city', self.get_item('City', prof_info))
+
+        address = al.load_item()
+        l.add_value('address', dict(address))
+
+        l.add_value('geo_query', prof_info['Location'])
+        l.add_value('phone_number', prof_info['Phone'])
 
-            l.add_value('company_name', self.get_item('UserDisplayName', prof_info))
+        l.add_value('company_name', self.get_item('UserDisplayName', prof_info))
 
-            l.add_value('service_cost', self.get_item('CostEstimateDescription', prof_info))
-            l.add_value('pro_rating', self.get_item('ReviewRating', prof_info))
-            l.add_value('reviews_count', self.get_item('ReviewCount', prof_info))
+        l.add_value('service_cost', self.get_item('CostEstimateDescription', prof_info))
+        l.add_value('pro_rating', self.get_item('ReviewRating', prof_info))
+        l.add_value('reviews_count', self.get_item('ReviewCount', prof_info))
 
-            yield l.load_item()
-        self.last_item += self.settings.get('ITEMS_ON_PAGE') + 1
+        return l.load_item()
 
     def get_item(self, key, dict_):
         """
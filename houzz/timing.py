@@ -0,0 +1,122 @@
+"""
+Histograms of time spent by the hot stages of the crawl.
+
+Functions decorated by ``timed`` record every call into ``TIMINGS`` which is exported by
+``houzz.extensions.TimingExtension``
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+# upper bounds of histogram buckets in seconds, the last bucket is unbounded
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    Count of observations per bucket. Observations can come from any thread
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        """
+        Estimate the percentile by the upper bound of the bucket it falls into
+
+        :param q: percentile from 0 to 1
+        :return: seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'max_ms': self.max * 1000,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+        }
+
+
+class Timings:
+    """
+    Histograms by stage name
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.observe(seconds)
+
+    def snapshot(self):
+        """
+        :return: summary of every stage
+        """
+        return {stage: histogram.summary() for stage, histogram in list(self.histograms.items())}
+
+
+TIMINGS = Timings()
+
+
+def timed(stage):
+    """
+    Decorator recording the time of each call into ``TIMINGS``. For generator functions, i.e. spider callbacks,
+    the time of producing values is summed while the time the consumer holds the generator isn't counted
+
+    :param stage: name of the stage
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                spent = 0.0
+                iterator = func(*args, **kwargs)
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        value = next(iterator)
+                    except StopIteration:
+                        break
+                    finally:
+                        spent += time.perf_counter() - started
+                    yield value
+                TIMINGS.observe(stage, spent)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    TIMINGS.observe(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
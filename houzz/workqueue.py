@@ -0,0 +1,201 @@
+"""
+Queue of API work units shared by the nodes of the distributed crawl.
+
+Units are documents of ``work_units`` collection. A node leases the unit by one atomic ``find_one_and_update``,
+renews the lease while it's crawling and marks the unit done at the end. The unit whose lease isn't renewed
+in time, because its node died, is leased by another node.
+
+``LocalWorkQueue`` has the same interface for the worker processes of one host, which take units
+from the orchestrator of ``python -m houzz``.
+"""
+import datetime
+import os
+import queue
+import socket
+
+import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.operations import UpdateOne
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+
+
+def node_id() -> str:
+    """
+    Name of the lease owner, unique for every process of every host
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    """
+    Work units of one crawl selected by the process hash. Documents look like
+
+        {'_id': '<process_hash>:<start>', 'process_hash': ..., 'start': 0, 'end': 75, 'state': 'pending',
+         'owner': None, 'lease_until': None, 'attempts': 0}
+    """
+    collection_name = 'work_units'
+
+    def __init__(self, mongo_uri, mongo_db, process_hash, lease_time=300, max_attempts=3):
+        self.process_hash = process_hash
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.client = pymongo.MongoClient(mongo_uri)
+        self.collection = self.client[mongo_db][self.collection_name]
+
+    @classmethod
+    def from_settings(cls, settings, process_hash):
+        return cls(settings.get('MONGO_URI'), settings.get('MONGO_DB'), process_hash,
+                   lease_time=settings.getfloat('WORK_LEASE_TIME', 300),
+                   max_attempts=settings.getint('WORK_MAX_ATTEMPTS', 3))
+
+    def ensure_indexes(self):
+        self.collection.create_index([('process_hash', pymongo.ASCENDING), ('state', pymongo.ASCENDING),
+                                      ('start', pymongo.ASCENDING)])
+
+    def publish(self, units):
+        """
+        Add the units which aren't in the queue yet, so every node can publish the same range
+
+        :param units: pairs of start and end offsets
+        """
+        operations = [
+            UpdateOne({'_id': f'{self.process_hash}:{start}'},
+                      {'$setOnInsert': {'process_hash': self.process_hash, 'start': start, 'end': end,
+                                        'state': PENDING, 'owner': None, 'lease_until': None, 'attempts': 0}},
+                      upsert=True)
+            for start, end in units
+        ]
+        if not operations:
+            return
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # concurrent upserts of the same unit by several nodes, one of them wins
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+
+    def lease(self, owner):
+        """
+        Take the first pending unit or the unit with the expired lease
+
+        :return: document of the unit or None if there is nothing to take now
+        """
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                'process_hash': self.process_hash,
+                'attempts': {'$lt': self.max_attempts},
+                '$or': [{'state': PENDING}, {'state': LEASED, 'lease_until': {'$lt': now}}],
+            },
+            {
+                '$set': {'state': LEASED, 'owner': owner,
+                         'lease_until': now + datetime.timedelta(seconds=self.lease_time)},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('start', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def renew(self, unit_id, owner) -> bool:
+        """
+        Extend the lease of the unit
+
+        :return: False if the lease is lost to another node
+        """
+        lease_until = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_time)
+        result = self.collection.update_one({'_id': unit_id, 'owner': owner, 'state': LEASED},
+                                            {'$set': {'lease_until': lease_until}})
+        return result.matched_count == 1
+
+    def complete(self, unit_id, owner):
+        self.collection.update_one({'_id': unit_id, 'owner': owner},
+                                   {'$set': {'state': DONE, 'lease_until': None,
+                                             'finished': datetime.datetime.utcnow()}})
+
+    def release(self, unit_id, owner):
+        """
+        Give the unit back to the queue, so it's leased again by some node
+        """
+        self.collection.update_one({'_id': unit_id, 'owner': owner, 'state': LEASED},
+                                   {'$set': {'state': PENDING, 'owner': None, 'lease_until': None}})
+
+    def counts(self) -> dict:
+        """
+        :return: amounts of units by state, units which are out of attempts and not leased are counted as 'failed'
+        """
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, 'failed': 0}
+        for unit in self._units():
+            counts['failed' if self._failed(unit) else unit['state']] += 1
+        return counts
+
+    def failed_units(self):
+        """
+        :return: pairs of start and end offsets of units which are out of attempts
+        """
+        return [(unit['start'], unit['end']) for unit in self._units() if self._failed(unit)]
+
+    def pending_units(self):
+        """
+        :return: pairs of start and end offsets of units which are waiting to be leased
+        """
+        return [(unit['start'], unit['end']) for unit in self._units()
+                if unit['state'] == PENDING and not self._failed(unit)]
+
+    def _units(self):
+        return self.collection.find({'process_hash': self.process_hash},
+                                    {'start': True, 'end': True, 'state': True, 'attempts': True, 'lease_until': True})
+
+    def _failed(self, unit) -> bool:
+        if unit['state'] == DONE or unit['attempts'] < self.max_attempts:
+            return False
+        return unit['state'] == PENDING or unit['lease_until'] < datetime.datetime.utcnow()
+
+    def close(self):
+        self.client.close()
+
+
+class LocalWorkQueue:
+    """
+    Units handed to the worker process by the orchestrator through multiprocessing queues. The worker reports
+    ``(kind, worker, unit id)`` messages back, where kind is 'leased', 'done' or 'failed', so the orchestrator
+    retries failed units and the units of the worker which died. None in the units queue means there are no more
+    """
+    lease_time = 300  # leases aren't kept by the queue, it's only how often ``APISpider`` renews them
+
+    def __init__(self, units, reports, worker):
+        self.units = units
+        self.reports = reports
+        self.worker = worker
+        self.closed = False
+
+    def lease(self, owner):
+        """
+        Wait until the orchestrator hands out the next unit, it's called by a thread of the reactor
+
+        :return: unit as ``{'_id': <start>, 'start': <start>, 'end': <end>}`` or None if there are no more
+        """
+        while not self.closed:
+            try:
+                unit = self.units.get(timeout=1)
+            except queue.Empty:
+                continue
+            if unit is not None:
+                self.reports.put(('leased', self.worker, unit['_id']))
+            return unit
+        return None
+
+    def renew(self, unit_id, owner) -> bool:
+        return True
+
+    def complete(self, unit_id, owner):
+        self.reports.put(('done', self.worker, unit_id))
+
+    def release(self, unit_id, owner):
+        self.reports.put(('failed', self.worker, unit_id))
+
+    def close(self):
+        self.closed = True